@@ -0,0 +1,115 @@
+import os
+import csv
+import datetime
+import tempfile
+import numpy as np
+import pandas as pd
+from concurrent.futures import ProcessPoolExecutor
+from results_store import load_store, split_answer_key, matches_key
+from report_common import university_logo
+import item_analysis
+import score_report
+
+# One run that reads the detected responses once and produces everything
+# score_report.py and item_analysis.py would, from the same in-memory dataset.
+
+def load_identities(folder):
+    """Resolved student IDs and names from scored_answers.csv, if process_answers.py has been run."""
+    scored_path = os.path.join(folder, 'scored_answers.csv')
+    if not os.path.isfile(scored_path):
+        return {}
+    with open(scored_path, newline='', encoding='utf-8') as f:
+        return {row['filename']: (row['student_id'], row.get('student_name', 'Unknown')) for row in csv.DictReader(f)}
+
+def load_dataset(folder, num_questions):
+    """Parse the responses once into the answer key, a students x questions correctness matrix and scores."""
+    store = load_store(folder)
+    filenames = np.array(store['filenames'], dtype=str)
+    key_row, students = split_answer_key(filenames)
+    if key_row is None:
+        raise ValueError("No row found where 'filename' contains 'answers'.")
+
+    correct = matches_key(store, students, key_row, num_questions)
+
+    identities = load_identities(folder)
+    detected_ids = np.array(store['student_ids'], dtype=str)[students]
+    names = [identities.get(f, (sid, 'Unknown')) for f, sid in zip(filenames[students], detected_ids)]
+    return {
+        "filenames": filenames[students],
+        "student_ids": [student_id for student_id, _ in names],
+        "student_names": [name for _, name in names],
+        "questions": [str(q + 1) for q in range(correct.shape[1])],
+        "correct": correct,
+        "scores": correct.sum(axis=1),
+    }
+
+def run_analytics(folder, num_questions, author_name, course_name, assessment_name, with_intervals=False):
+    data = load_dataset(folder, num_questions)
+    num_questions = len(data['questions'])
+
+    report_date = datetime.datetime.now().strftime("%d %B %Y")
+    report_subheading = f"Course: {course_name}"
+    report_author = f"Report generated by {author_name} on {report_date}"
+
+    scores_df = pd.DataFrame({
+        'filename': data['filenames'],
+        'student_id': data['student_ids'],
+        'student_name': data['student_names'],
+        'score': data['scores'],
+        'percentage_score': np.round(100 * data['scores'] / num_questions, 1),
+    })
+    report_df = scores_df[['student_id', 'student_name', 'percentage_score']].sort_values(by='student_name')
+
+    item_df, pdf_item_df, reliability_text = item_analysis.item_statistics(
+        data['correct'].astype(float), data['questions'], with_intervals)
+    summary = item_analysis.summary_statistics(data['scores'], num_questions, reliability_text)
+
+    print("\n=== ITEM ANALYSIS SUMMARY ===")
+    for k, v in summary.items():
+        print(f"{k}: {v}")
+
+    with tempfile.NamedTemporaryFile(suffix=".png", delete=False) as tmp_img:
+        histogram_path = tmp_img.name
+    item_analysis.generate_score_histogram(pd.DataFrame({'total_score': data['scores']}), histogram_path)
+    uni_logo_png = university_logo()
+
+    scores_csv = os.path.join(folder, "student_scores.csv")
+    item_csv = os.path.join(folder, "item_analysis_output.csv")
+
+    # Both PDFs are built in their own process while the CSVs are written here. The score
+    # report keeps the scored_answers_report.pdf name that score_report.py gives it.
+    with ProcessPoolExecutor(2) as pool:
+        reports = [
+            pool.submit(score_report.generate_pdf, os.path.join(folder, "scored_answers.csv"), report_df,
+                        "Score Report", report_subheading, report_author, course_name, assessment_name,
+                        "staple.png", uni_logo_png),
+            pool.submit(item_analysis.generate_pdf, item_csv, summary, pdf_item_df, histogram_path,
+                        "Item Analysis Report", report_subheading, report_author, course_name, assessment_name,
+                        "staple.png", uni_logo_png, with_intervals),
+        ]
+        scores_df.to_csv(scores_csv, index=False)
+        print(f"\n✅ CSV saved to: {scores_csv}")
+        item_df.to_csv(item_csv, index=False)
+        print(f"✅ CSV saved to: {item_csv}")
+        for report in reports:
+            report.result()
+
+    os.remove(histogram_path)
+
+def main():
+    folder = input("Enter the path to the directory containing all_detected_answers.csv: ").strip()
+    num_questions = int(input("Enter the number of questions to include in the analysis (e.g., 32): "))
+    author_name = input("Enter the name of the person generating the report: ").strip()
+    course_name = input("Enter the course name: ").strip()
+    assessment_name = input("Enter the assessment name: ").strip()
+    with_intervals = input("Compute bootstrap confidence intervals for the item statistics? (y/n): ").strip().lower() == 'y'
+
+    try:
+        run_analytics(folder, num_questions, author_name, course_name, assessment_name, with_intervals)
+    except (FileNotFoundError, ValueError) as e:
+        print(f"\n❌ {e}")
+        return
+    print("\n✅ Analytics complete.")
+
+if __name__ == "__main__":
+    main()
@@ -6,24 +6,74 @@ import matplotlib
 matplotlib.use("TkAgg")
 import matplotlib.pyplot as plt
 import random
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+import fitz  # PyMuPDF
 from tqdm import tqdm
+from process_pdf import render_page_array
+from results_store import write_store, rebuild_store_from_csv
+from page_store import list_pages, read_page
+from page_hash import load_hash_index, save_hash_index, forget_pages, match_page, index_page, ink_map, record_duplicates
 
 # --- Settings ---
 bubble_radius = 10
 x_offset_3rd = -588
 x_offset_12th = -103
+id_thumb_width = 800  # width of the cached ID-region thumbnails used during manual ID resolution
+skip_duplicates = False  # True: re-scanned sheets are not detected again, only listed in duplicate_scans.csv
+retry_workers = None  # processes used to retry quarantined sheets (None = one per CPU core)
+read_ahead = 4  # pages decoded on background threads while the current page is processed (0 = off)
+calibration_mode = "auto"  # "auto": calibrate from a sample of sheets; "manual": click the bubbles on one sheet
+auto_calibration_sample = 25  # sheets combined for automatic calibration
+group_order = "rows"  # question order of the 5x5 groups: "rows" (left to right, then down) or "columns" (down, then right)
+
+# Settings tried, in order, on sheets that fail detection. Each step keeps the previous ones.
+fallback_ladder = [
+    {"name": "widened HSV ranges", "wide_hsv": True},
+    {"name": "adaptive thresholds", "wide_hsv": True, "adaptive": True},
+    {"name": "deskew", "wide_hsv": True, "adaptive": True, "deskew": True},
+    {"name": "600 dpi re-render", "wide_hsv": True, "adaptive": True, "deskew": True, "rerender_dpi": 600},
+]
+
+# === Buffer Reuse ===
+# A worker processing many sheets can hand the same buffers dict to every call so the
+# intermediates are allocated once, not once per sheet. Each buffer is a flat array that
+# only ever grows, and callers get a contiguous view of the exact shape they ask for, so
+# the warped ROI (whose size follows each sheet's detected box and varies by a few
+# pixels between scans) reuses the same memory too.
+buffer_headroom = 1.05  # a new buffer is made this much larger than requested, so slightly bigger sheets still fit
+
+def make_buffers():
+    return {}
+
+def get_buffer(buffers, name, shape, dtype=np.uint8):
+    if buffers is None:
+        return None
+    size = int(np.prod(shape))
+    buf = buffers.get(name)
+    if buf is None or buf.size < size or buf.dtype != dtype:
+        buf = buffers[name] = np.empty(int(size * buffer_headroom), dtype=dtype)
+    return buf[:size].reshape(shape)
 
 # === Red Box Detection ===
-def detect_red_box(image, min_width=0, min_height=0, pad=20):
-    hsv = cv2.cvtColor(image, cv2.COLOR_BGR2HSV)
-    lower1 = np.array([0, 100, 50])
-    upper1 = np.array([15, 255, 255])
-    lower2 = np.array([160, 100, 50])
-    upper2 = np.array([180, 255, 255])
-    mask = cv2.inRange(hsv, lower1, upper1) | cv2.inRange(hsv, lower2, upper2)
-
-    blurred = cv2.GaussianBlur(mask, (5, 5), 0)
-    edges = cv2.Canny(blurred, 30, 100)
+def red_mask(image, wide_hsv=False, buffers=None):
+    """Binary mask of red pixels; wide_hsv also accepts faded, pinkish and orange-tinted reds."""
+    page_shape = image.shape[:2]
+    hsv = cv2.cvtColor(image, cv2.COLOR_BGR2HSV, dst=get_buffer(buffers, "hsv", image.shape))
+    if wide_hsv:
+        lower1, upper1 = np.array([0, 60, 40]), np.array([20, 255, 255])
+        lower2, upper2 = np.array([150, 60, 40]), np.array([180, 255, 255])
+    else:
+        lower1, upper1 = np.array([0, 100, 50]), np.array([15, 255, 255])
+        lower2, upper2 = np.array([160, 100, 50]), np.array([180, 255, 255])
+    mask = cv2.inRange(hsv, lower1, upper1, dst=get_buffer(buffers, "mask", page_shape))
+    scratch = cv2.inRange(hsv, lower2, upper2, dst=get_buffer(buffers, "scratch", page_shape))
+    return cv2.bitwise_or(mask, scratch, dst=mask), scratch
+
+def detect_red_box(image, min_width=0, min_height=0, pad=20, buffers=None, wide_hsv=False):
+    mask, scratch = red_mask(image, wide_hsv, buffers)
+    blurred = cv2.GaussianBlur(mask, (5, 5), 0, dst=scratch)
+    edges = cv2.Canny(blurred, 30, 100, edges=mask)
     contours, _ = cv2.findContours(edges, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
 
     if not contours:
@@ -61,14 +111,15 @@ def order_points(pts):
         pts[np.argmax(diff)]
     ], dtype="float32")
 
-def warp_roi(image, pts):
+def warp_roi(image, pts, buffers=None):
     rect = order_points(pts)
     (tl, tr, br, bl) = rect
     width = int(max(np.linalg.norm(br - bl), np.linalg.norm(tr - tl)))
     height = int(max(np.linalg.norm(tr - br), np.linalg.norm(tl - bl)))
     dst = np.array([[0, 0], [width - 1, 0], [width - 1, height - 1], [0, height - 1]], dtype="float32")
     M = cv2.getPerspectiveTransform(rect, dst)
-    warped = cv2.warpPerspective(image, M, (width, height))
+    warped = cv2.warpPerspective(image, M, (width, height),
+                                 dst=get_buffer(buffers, "roi", (height, width) + image.shape[2:]))
     return warped
 
 def add_purple_border(image, border=20):
@@ -87,9 +138,7 @@ def interpolate_25(p1, p2):
 
 def calibrate_bubbles(folder, coords_path, min_width, min_height):
     print("🔧 Step 1: Calibrating bubble positions (click pairs of FIRST and LAST bubbles in each 5x5 group)...")
-    png_files = [f for f in os.listdir(folder) if f.lower().endswith(".png")]
-    img_path = os.path.join(folder, random.choice(png_files))
-    image = cv2.imread(img_path)
+    image = read_page(folder, random.choice(list_pages(folder)))
     box = detect_red_box(image, min_width, min_height)
     roi = warp_roi(image, box)
     roi_rgb = cv2.cvtColor(roi, cv2.COLOR_BGR2RGB)
@@ -120,9 +169,7 @@ def calibrate_bubbles(folder, coords_path, min_width, min_height):
 
 def calibrate_min_roi_size(folder, min_size_path):
     print("📐 Step 2: Calibrating minimum ROI dimensions (click top-left and bottom-right)...")
-    png_files = [f for f in os.listdir(folder) if f.lower().endswith(".png")]
-    img_path = os.path.join(folder, random.choice(png_files))
-    image = cv2.imread(img_path)
+    image = read_page(folder, random.choice(list_pages(folder)))
     box = detect_red_box(image)
     roi = warp_roi(image, box)
     roi_rgb = cv2.cvtColor(roi, cv2.COLOR_BGR2RGB)
@@ -152,15 +199,176 @@ def calibrate_min_roi_size(folder, min_size_path):
     print(f"✅ Minimum ROI size set to {min_width}x{min_height}")
     return min_width, min_height
 
+# === Automatic Calibration ===
+# Instead of clicking on one sheet, the ROIs of a sample of sheets are warped to a common
+# size and combined. A high percentile of the stack is the printed form with (almost) no
+# marks on it, whatever answers students chose, and the printed bubbles are found in it
+# with Hough circles. They must form clean 5x5 grids or calibration fails. The mean of
+# the stack then shows which grids students answered, so only those are calibrated, as
+# with manual calibration.
+def cohort_rois(folder, sample_size):
+    """Grayscale ROIs of an evenly spaced sample of sheets, resized to their median size."""
+    pages = list_pages(folder)
+    rois = []
+    sample = pages[::max(1, len(pages) // sample_size)][:sample_size]
+    for filename, image, error in prefetch_pages(folder, sample):
+        if error:
+            continue
+        try:
+            rois.append(cv2.cvtColor(warp_roi(image, detect_red_box(image)), cv2.COLOR_BGR2GRAY))
+        except ValueError:
+            continue
+    if len(rois) < 3:
+        raise ValueError("Too few sheets with a readable red box to calibrate from.")
+
+    width, height = np.median([roi.shape[::-1] for roi in rois], axis=0).astype(int)
+    return np.stack([cv2.resize(roi, (width, height), interpolation=cv2.INTER_AREA) for roi in rois])
+
+def cohort_images(stack, strip=128):
+    """Printed form and mean of the ROI stack, computed in strips to keep memory use down.
+
+    The form is the 90th percentile, so a bubble only shows as filled in it if nearly
+    every sampled student marked it.
+    """
+    form = np.empty(stack.shape[1:], dtype=np.uint8)
+    mean = np.empty(stack.shape[1:], dtype=np.float32)
+    for y in range(0, stack.shape[1], strip):
+        rows = stack[:, y:y + strip]
+        form[y:y + strip] = np.percentile(rows, 90, axis=0)
+        mean[y:y + strip] = rows.mean(axis=0)
+    return form, mean
+
+def find_printed_bubbles(form):
+    """Centres and typical diameter of the bubbles printed on the form."""
+    width = form.shape[1]
+    circles = cv2.HoughCircles(cv2.GaussianBlur(form, (5, 5), 0), cv2.HOUGH_GRADIENT_ALT, dp=1.5,
+                               minDist=max(4, int(0.008 * width)), param1=300, param2=0.8,
+                               minRadius=int(0.004 * width), maxRadius=int(0.02 * width))
+    if circles is None or len(circles[0]) < 25:
+        raise ValueError("Could not find the printed bubbles.")
+    circles = circles[0]
+    radius = np.median(circles[:, 2])
+    # Circles of a different size are letters, digits or logos printed on the form.
+    circles = circles[np.abs(circles[:, 2] - radius) < 0.2 * radius]
+    return circles[:, :2], 2 * float(radius)
+
+def nearest_spacing(points, diameter, axis):
+    """Median distance to the next bubble along one axis, among bubbles in line with each other."""
+    delta = points[None, :, :] - points[:, None, :]
+    along, across = delta[..., axis], np.abs(delta[..., 1 - axis])
+    ahead = np.where((along > diameter / 2) & (across < diameter / 2), along, np.inf).min(axis=1)
+    return float(np.median(ahead[np.isfinite(ahead)]))
+
+def line_counts(values, diameter):
+    """For each value, how many of the values lie on the same line (within half a bubble of each other)."""
+    order = np.argsort(values)
+    labels = np.empty(len(values), dtype=int)
+    labels[order] = np.cumsum(np.r_[0, np.diff(values[order]) > diameter / 2])
+    return np.bincount(labels)[labels]
+
+def grid_lines(values, diameter):
+    """Fit the first and last of the 5 evenly spaced lines a group's 25 bubbles lie on along one axis."""
+    values = np.sort(values)
+    lines = np.split(values, np.flatnonzero(np.diff(values) > diameter / 2) + 1)
+    if len(lines) != 5 or any(len(line) != 5 for line in lines):
+        raise ValueError("A bubble group does not line up as a 5x5 grid.")
+    centres = np.array([line.mean() for line in lines])
+    gaps = np.diff(centres)
+    if gaps.max() > 1.25 * gaps.min():
+        raise ValueError("A bubble group is not evenly spaced.")
+    slope, first = np.polyfit(np.arange(5), centres, 1)
+    return first, first + 4 * slope
+
+def group_bubbles(points, diameter, shape):
+    """Split printed bubbles into 5x5 groups and return their (first, last) bubbles in question order."""
+    sx, sy = nearest_spacing(points, diameter, 0), nearest_spacing(points, diameter, 1)
+    canvas = np.zeros(shape, dtype=np.uint8)
+    for x, y in points:
+        cv2.rectangle(canvas, (int(x - 0.6 * sx), int(y - 0.6 * sy)), (int(x + 0.6 * sx), int(y + 0.6 * sy)), 255, -1)
+    _, labels = cv2.connectedComponents(canvas)
+    point_labels = labels[points[:, 1].astype(int), points[:, 0].astype(int)]
+
+    groups = []
+    for label in np.unique(point_labels):
+        members = points[point_labels == label]
+        # A circle printed next to a group (e.g. the 0 of a question number) shares a row
+        # with its bubbles but not a column, so it is dropped.
+        members = members[(line_counts(members[:, 0], diameter) >= 3) & (line_counts(members[:, 1], diameter) >= 3)]
+        if len(members) < 5:
+            continue  # a stray circle printed on the form, not part of a grid
+        (x1, x2), (y1, y2) = grid_lines(members[:, 0], diameter), grid_lines(members[:, 1], diameter)
+        groups.append(((x1, y1), (x2, y2)))
+    if not groups:
+        raise ValueError("No 5x5 bubble groups found.")
+
+    for i, (a1, a2) in enumerate(groups):
+        for b1, b2 in groups[i + 1:]:
+            if a1[0] - diameter < b2[0] and b1[0] - diameter < a2[0] and a1[1] - diameter < b2[1] and b1[1] - diameter < a2[1]:
+                raise ValueError("Bubble groups overlap.")
+
+    # Groups starting within half a group height of each other are on the same row
+    # (or, for group_order = "columns", within half a group width on the same column).
+    along = 0 if group_order == "columns" else 1
+    size = np.median([last[along] - first[along] for first, last in groups])
+    bands, band_start = [], None
+    for group in sorted(groups, key=lambda g: g[0][along]):
+        if band_start is None or group[0][along] - band_start > size / 2:
+            band_start = group[0][along]
+            bands.append([])
+        bands[-1].append(group)
+    return [group for band in bands for group in sorted(band, key=lambda g: g[0][1 - along])]
+
+def answered_groups(groups, mean, diameter):
+    """Keep the groups in which some bubble is clearly darker on average than an empty one."""
+    r = max(2, int(diameter / 4))
+    darkness = np.array([[255 - mean[y - r:y + r, x - r:x + r].mean() for x, y in interpolate_25(first, last)]
+                         for first, last in groups])
+    marked = (darkness - np.median(darkness)).max(axis=1)
+    if marked.max() < 20:
+        raise ValueError("No marked bubbles found.")
+    return [group for group, m in zip(groups, marked) if m >= 0.25 * marked.max()]
+
+def auto_calibrate(folder, coords_path, min_size_path):
+    print(f"🤖 Calibrating automatically from up to {auto_calibration_sample} sheets...")
+    stack = cohort_rois(folder, auto_calibration_sample)
+    form, mean = cohort_images(stack)
+    points, diameter = find_printed_bubbles(form)
+    groups = answered_groups(group_bubbles(points, diameter, form.shape), mean, diameter)
+
+    bubble_coords = []
+    for first, last in groups:
+        bubble_coords.extend(interpolate_25(first, last))
+
+    # The minimum ROI size only needs to catch boxes that were badly detected, so it is set
+    # a little below the typical ROI size rather than at it.
+    min_height, min_width = (0.9 * np.array(form.shape)).astype(int)
+
+    preview = cv2.cvtColor(form, cv2.COLOR_GRAY2BGR)
+    for q, (x, y) in enumerate(bubble_coords):
+        cv2.circle(preview, (x, y), bubble_radius, (0, 0, 255), 2)
+        if q % 5 == 0:
+            cv2.putText(preview, str(q // 5 + 1), (x - 60, y + 8), cv2.FONT_HERSHEY_SIMPLEX, 0.8, (255, 0, 0), 2)
+    cv2.imwrite(os.path.join(folder, "auto_calibration.jpg"), preview)
+
+    with open(coords_path, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(["x", "y"])
+        writer.writerows(bubble_coords)
+    with open(min_size_path, "w") as f:
+        f.write(f"{min_width},{min_height}")
+    print(f"✅ Found {len(groups)} bubble groups ({5 * len(groups)} questions). "
+          f"Check auto_calibration.jpg before trusting the results.")
+
 # === Main Pipeline ===
-def main():
-    folder = input("📂 Enter folder with PNG files: ").strip()
+def load_calibration(folder):
     coords_path = os.path.join(folder, "bubble_coords.csv")
     min_size_path = os.path.join(folder, "min_roi_size.txt")
-    answer_csv_path = os.path.join(folder, "all_detected_answers.csv")
-    student_id_csv_path = os.path.join(folder, "file_student_id.csv")
-    annotated_dir = os.path.join(folder, "annotated")
-    os.makedirs(annotated_dir, exist_ok=True)
+
+    if calibration_mode == "auto" and not (os.path.exists(coords_path) and os.path.exists(min_size_path)):
+        try:
+            auto_calibrate(folder, coords_path, min_size_path)
+        except ValueError as e:
+            print(f"⚠️ Automatic calibration failed ({e}), falling back to manual calibration.")
 
     if not os.path.exists(min_size_path):
         min_width, min_height = calibrate_min_roi_size(folder, min_size_path)
@@ -175,66 +383,326 @@ def main():
         bubble_coords = [(int(row["x"]), int(row["y"])) for row in csv.DictReader(f)]
 
     half_box = int(np.mean([bubble_coords[i + 1][0] - bubble_coords[i][0] for i in range(4)]) // 2)
-    png_files = sorted([f for f in os.listdir(folder) if f.lower().endswith(".png")])
-    all_results = []
-    student_ids = []
+    return {
+        "bubble_coords": bubble_coords,
+        "half_box": half_box,
+        "min_width": min_width,
+        "min_height": min_height,
+    }
+
+def read_answers(roi, bubble_coords, half_box, buffers=None, adaptive=False):
+    roi_gray = cv2.cvtColor(roi, cv2.COLOR_BGR2GRAY, dst=get_buffer(buffers, "roi_gray", roi.shape[:2]))
+    if adaptive:
+        roi_thresh = cv2.adaptiveThreshold(roi_gray, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C,
+                                           cv2.THRESH_BINARY, 51, 15, dst=get_buffer(buffers, "roi_thresh", roi.shape[:2]))
+    else:
+        _, roi_thresh = cv2.threshold(roi_gray, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU, dst=roi_gray)
+    answers, confidences = [], []
+    roi_annotated = get_buffer(buffers, "roi_annotated", roi.shape)
+    if roi_annotated is None:
+        roi_annotated = roi.copy()
+    else:
+        np.copyto(roi_annotated, roi)
+
+    for i in range(0, len(bubble_coords), 5):
+        group = bubble_coords[i:i + 5]
+        fill_counts, boxes = [], []
+        for x, y in group:
+            x1, x2 = max(0, x - half_box), min(roi.shape[1], x + half_box)
+            y1, y2 = max(0, y - half_box), min(roi.shape[0], y + half_box)
+            box_img = roi_thresh[y1:y2, x1:x2]
+            fill_counts.append(np.sum(box_img < 128))
+            boxes.append((x1, y1, x2, y2))
+
+        selected = int(np.argmax(fill_counts))
+        answers.append("ABCDE"[selected])
+        confidences.append(fill_margin(fill_counts))
+        for j, (x1, y1, x2, y2) in enumerate(boxes):
+            color = (255, 0, 0) if j == selected else (0, 255, 0)
+            thickness = -1 if j == selected else 1
+            cv2.rectangle(roi_annotated, (x1, y1), (x2, y2), color, thickness)
+
+    return answers, confidences, roi_annotated
+
+def fill_margin(fill_counts):
+    """Relative gap between the most and second most filled bubble (0 = tie, 1 = only one filled)."""
+    top, second = sorted(fill_counts, reverse=True)[:2]
+    return round(float(top - second) / top, 3) if top else 0.0
+
+def deskew_page(image, wide_hsv=False):
+    """Rotate the page so the red ROI box is axis-aligned."""
+    mask, _ = red_mask(image, wide_hsv)
+    contours, _ = cv2.findContours(mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+    if not contours:
+        raise ValueError("No red contours found.")
+    (cx, cy), _, angle = cv2.minAreaRect(max(contours, key=cv2.contourArea))
+    # minAreaRect reports angles in a 90 degree range that differs between OpenCV versions.
+    if angle > 45:
+        angle -= 90
+    elif angle < -45:
+        angle += 90
+    M = cv2.getRotationMatrix2D((cx, cy), angle, 1.0)
+    return cv2.warpAffine(image, M, (image.shape[1], image.shape[0]),
+                          flags=cv2.INTER_LINEAR, borderValue=(255, 255, 255))
+
+def detect_sheet(img, calibration, buffers=None, settings=None):
+    """Detect one sheet. With buffers, the returned annotated image is only valid until the next call.
+
+    settings is one of the fallback_ladder entries; by default the standard detection is used.
+    """
+    settings = settings or {}
+    if settings.get("deskew"):
+        img = deskew_page(img, settings.get("wide_hsv", False))
+    box = detect_red_box(img, calibration["min_width"], calibration["min_height"], buffers=buffers,
+                         wide_hsv=settings.get("wide_hsv", False))
+    roi = warp_roi(img, box, buffers)
+    answers, confidences, roi_annotated = read_answers(roi, calibration["bubble_coords"], calibration["half_box"],
+                                                       buffers, settings.get("adaptive", False))
+
+    student_grid = generate_student_id_grid(img, settings.get("adaptive", False))
+    id_scores = student_id_scores(img, student_grid)
+    return {
+        "answers": answers,
+        "answer_confidences": confidences,
+        "student_id": decode_student_id(id_scores),
+        "student_id_confidences": digit_confidences(id_scores),
+        "student_id_scores": np.round(id_scores, 1).tolist(),
+        "annotated": roi_annotated,
+    }
+
+def try_read_page(folder, filename):
+    try:
+        return read_page(folder, filename), None
+    except Exception as e:
+        return None, e
+
+def prefetch_pages(folder, filenames, depth=None):
+    """Yield (filename, image, error) in order while decoding up to depth pages ahead on threads.
+
+    cv2.imread releases the GIL, so reading the next pages from disk (or a network share)
+    overlaps with processing the current one.
+    """
+    depth = read_ahead if depth is None else depth
+    if depth <= 0:
+        for filename in filenames:
+            yield (filename, *try_read_page(folder, filename))
+        return
+
+    with ThreadPoolExecutor(max_workers=depth) as pool:
+        pending = deque()
+        for filename in filenames:
+            pending.append((filename, pool.submit(try_read_page, folder, filename)))
+            if len(pending) > depth:
+                name, future = pending.popleft()
+                yield (name, *future.result())
+        while pending:
+            name, future = pending.popleft()
+            yield (name, *future.result())
+
+def save_id_thumbnail(img, folder, filename):
+    """Save a small JPEG of the top 25% of the page, which is all process_answers shows during ID resolution."""
+    top = img[:img.shape[0] // 4]
+    height = round(top.shape[0] * id_thumb_width / top.shape[1])
+    thumb = cv2.resize(top, (id_thumb_width, height), interpolation=cv2.INTER_AREA)
+    cv2.imwrite(os.path.join(folder, "id_thumbs", f"{os.path.splitext(filename)[0]}.jpg"), thumb,
+                [cv2.IMWRITE_JPEG_QUALITY, 85])
+
+def process_sheet(img, filename, calibration, folder, buffers=None, settings=None):
+    result = detect_sheet(img, calibration, buffers, settings)
+    annotated_path = os.path.join(folder, "annotated", f"{os.path.splitext(filename)[0]}_annotated.png")
+    cv2.imwrite(annotated_path, result.pop("annotated"))
+    save_id_thumbnail(img, folder, filename)
+    return {"filename": filename, **result}
+
+def results_header():
+    return ["filename"] + list(map(str, range(1, 36))) + ["student_id"]
+
+def merge_rows(path, header, new_rows, append):
+    """Write a results CSV. When appending, rows already present for the same filename are replaced in place."""
+    rows = []
+    if append and os.path.exists(path):
+        with open(path, newline="") as f:
+            rows = [r for r in csv.reader(f)][1:]
+    replacements = {row[0]: row for row in new_rows}
+    rows = [replacements.pop(r[0], r) for r in rows if r] + [row for row in new_rows if row[0] in replacements]
+
+    with open(path, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(header)
+        writer.writerows(rows)
 
-    for filename in tqdm(png_files, desc="Processing Sheets"):
-        try:
-            img = cv2.imread(os.path.join(folder, filename))
-            box = detect_red_box(img, min_width, min_height)
-            roi = warp_roi(img, box)
-
-            roi_gray = cv2.cvtColor(roi, cv2.COLOR_BGR2GRAY)
-            _, roi_thresh = cv2.threshold(roi_gray, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
-            answers = []
-            roi_annotated = roi.copy()
-
-            for i in range(0, len(bubble_coords), 5):
-                group = bubble_coords[i:i + 5]
-                fill_counts, boxes = [], []
-                for x, y in group:
-                    x1, x2 = max(0, x - half_box), min(roi.shape[1], x + half_box)
-                    y1, y2 = max(0, y - half_box), min(roi.shape[0], y + half_box)
-                    box_img = roi_thresh[y1:y2, x1:x2]
-                    fill_counts.append(np.sum(box_img < 128))
-                    boxes.append((x1, y1, x2, y2))
-
-                selected = int(np.argmax(fill_counts))
-                answers.append("ABCDE"[selected])
-                for j, (x1, y1, x2, y2) in enumerate(boxes):
-                    color = (255, 0, 0) if j == selected else (0, 255, 0)
-                    thickness = -1 if j == selected else 1
-                    cv2.rectangle(roi_annotated, (x1, y1), (x2, y2), color, thickness)
-
-            all_results.append([filename] + answers)
-            student_grid = generate_student_id_grid(img)
-            student_ids.append((filename, extract_student_id(img, student_grid)))
-            cv2.imwrite(os.path.join(annotated_dir, f"{os.path.splitext(filename)[0]}_annotated.png"), roi_annotated)
+def write_results(folder, records, append=False):
+    merge_rows(os.path.join(folder, "file_student_id.csv"), ["file", "student_id"],
+               [[r["filename"], r["student_id"]] for r in records], append)
+    merge_rows(os.path.join(folder, "all_detected_answers.csv"), results_header(),
+               [[r["filename"]] + r["answers"] + [r["student_id"]] for r in records], append)
 
+    if append:
+        rebuild_store_from_csv(folder, records)
+    else:
+        write_store(folder, records)
+
+def process_pages(folder, filenames, calibration, buffers=None, hash_index=None):
+    """Detect a list of pages, flagging re-scans against the page hash index first."""
+    os.makedirs(os.path.join(folder, "annotated"), exist_ok=True)
+    os.makedirs(os.path.join(folder, "id_thumbs"), exist_ok=True)
+    if hash_index is None:
+        hash_index = load_hash_index(folder)
+    forget_pages(hash_index, filenames)
+    records, duplicates, failed = [], [], []
+
+    pages = prefetch_pages(folder, filenames)
+    for filename, img, error in tqdm(pages, total=len(filenames), desc="Processing Sheets"):
+        try:
+            if error:
+                raise error
+            # Only detected pages are indexed, so a re-scan of a sheet that failed is never skipped.
+            ink, duplicate_of, score = match_page(hash_index, img, page_student_id(img))
+            if duplicate_of:
+                duplicates.append((filename, duplicate_of, score))
+                print(f"\n♻️ {filename} looks like a re-scan of {duplicate_of} (similarity {score})")
+                if skip_duplicates:
+                    continue
+            record = process_sheet(img, filename, calibration, folder, buffers)
+            records.append(record)
+            index_page(hash_index, filename, ink, record["student_id"])
         except Exception as e:
             print(f"\n❌ {filename} failed: {e}")
+            failed.append((filename, str(e)))
+
+    save_hash_index(folder, hash_index)
+    record_duplicates(folder, duplicates, filenames)
+    return records, failed
+
+# === Quarantine + Fallback Retry ===
+def read_quarantine(folder):
+    quarantine_path = os.path.join(folder, "quarantine.csv")
+    if not os.path.exists(quarantine_path):
+        return []
+    with open(quarantine_path, newline="") as f:
+        return list(csv.DictReader(f))
+
+def update_quarantine(folder, entries):
+    """Add or replace quarantine.csv rows (dicts with filename, reason, status, fallback)."""
+    updated = {e["filename"]: e for e in entries}
+    rows = [r for r in read_quarantine(folder) if r["filename"] not in updated] + list(updated.values())
+    with open(os.path.join(folder, "quarantine.csv"), "w", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=["filename", "reason", "status", "fallback"])
+        writer.writeheader()
+        writer.writerows(sorted(rows, key=lambda r: r["filename"]))
+
+def quarantine_pages(folder, failed):
+    update_quarantine(folder, [{"filename": f, "reason": reason, "status": "quarantined", "fallback": ""}
+                               for f, reason in failed])
+
+def resolve_quarantine(folder, filenames):
+    """Mark quarantined sheets that have since been detected normally, so they are not retried again."""
+    detected = set(filenames)
+    resolved = [dict(r, status="resolved", fallback="") for r in read_quarantine(folder)
+                if r["filename"] in detected and r["status"] == "quarantined"]
+    if resolved:
+        update_quarantine(folder, resolved)
+
+def rerender_page(folder, filename, dpi):
+    """Render a page again from its source PDF at a higher DPI, then downsample to the calibrated 300 dpi."""
+    sources_path = os.path.join(folder, "page_sources.csv")
+    if not os.path.exists(sources_path):
+        raise ValueError("No page_sources.csv to re-render from.")
+    with open(sources_path, newline="") as f:
+        sources = {row["filename"]: row for row in csv.DictReader(f)}
+    if filename not in sources:
+        raise ValueError("Page not listed in page_sources.csv.")
+
+    source = sources[filename]
+    with fitz.open(source["source_pdf"]) as doc:
+        page_num = int(source["page"]) - 1
+        rect = doc.load_page(page_num).rect
+        img = render_page_array(doc, page_num, dpi)
+    size = (round(rect.width * 300 / 72), round(rect.height * 300 / 72))
+    return cv2.resize(img, size, interpolation=cv2.INTER_AREA)
+
+def index_recovered_pages(folder, records, hash_index=None):
+    """Add sheets recovered from quarantine to the page hash index, now that they have been detected."""
+    if not records:
+        return
+    if hash_index is None:
+        hash_index = load_hash_index(folder)
+    for r in records:
+        try:
+            index_page(hash_index, r["filename"], ink_map(read_page(folder, r["filename"])), r["student_id"])
+        except Exception as e:
+            print(f"\n⚠️ Could not hash {r['filename']}: {e}")
+    save_hash_index(folder, hash_index)
 
-    with open(student_id_csv_path, "w", newline="") as f:
-        csv.writer(f).writerows([["file", "student_id"]] + student_ids)
-
-    student_map = dict(student_ids)
-    header = ["filename"] + list(map(str, range(1, 36))) + ["student_id"]
-    with open(answer_csv_path, "w", newline="") as f:
-        writer = csv.writer(f)
-        writer.writerow(header)
-        for row in all_results:
-            writer.writerow(row + [student_map.get(row[0], "")])
+def retry_page(folder, filename, calibration):
+    """Work through fallback_ladder until one setting detects the sheet."""
+    errors = []
+    for settings in fallback_ladder:
+        try:
+            if settings.get("rerender_dpi"):
+                img = rerender_page(folder, filename, settings["rerender_dpi"])
+            else:
+                img = read_page(folder, filename)
+            return filename, process_sheet(img, filename, calibration, folder, settings=settings), settings["name"]
+        except Exception as e:
+            errors.append(f"{settings['name']}: {e}")
+    return filename, None, "; ".join(errors)
+
+def retry_quarantine(folder, calibration, filenames=None):
+    """Retry quarantined sheets in parallel and return the records of those that were recovered."""
+    if filenames is None:
+        filenames = [r["filename"] for r in read_quarantine(folder) if r["status"] == "quarantined"]
+    if not filenames:
+        return []
+
+    recovered, updates = [], []
+    reasons = {r["filename"]: r["reason"] for r in read_quarantine(folder)}
+    with ProcessPoolExecutor(retry_workers) as pool:
+        futures = [pool.submit(retry_page, folder, f, calibration) for f in filenames]
+        for future in tqdm(as_completed(futures), total=len(futures), desc="Retrying Quarantined Sheets"):
+            filename, record, detail = future.result()
+            if record:
+                recovered.append(record)
+                updates.append({"filename": filename, "reason": reasons.get(filename, ""),
+                                "status": "recovered", "fallback": detail})
+            else:
+                updates.append({"filename": filename, "reason": reasons.get(filename, ""),
+                                "status": "quarantined", "fallback": detail})
+
+    update_quarantine(folder, updates)
+    print(f"\n🩹 Recovered {len(recovered)} of {len(filenames)} quarantined sheets.")
+    return sorted(recovered, key=lambda r: r["filename"])
+
+def detect_with_retry(folder, filenames, calibration, buffers=None, hash_index=None):
+    """process_pages, then quarantine any failures and retry them with the fallback ladder."""
+    if hash_index is None:
+        hash_index = load_hash_index(folder)
+    records, failed = process_pages(folder, filenames, calibration, buffers, hash_index)
+    resolve_quarantine(folder, [r["filename"] for r in records])
+    if failed:
+        quarantine_pages(folder, failed)
+        recovered = retry_quarantine(folder, calibration, [f for f, _ in failed])
+        index_recovered_pages(folder, recovered, hash_index)
+        records = sorted(records + recovered, key=lambda r: r["filename"])
+    return records
 
+def main():
+    folder = input("📂 Enter folder with PNG files or a page store: ").strip()
+    calibration = load_calibration(folder)
+    records = detect_with_retry(folder, list_pages(folder), calibration, make_buffers())
+    write_results(folder, records)
     print("\n✅ Processing complete.")
 
 # === Student ID Grid + Extraction ===
-def generate_student_id_grid(image):
+def generate_student_id_grid(image, adaptive=False):
     h, w = image.shape[:2]
     right_crop = image[:, int(w * 0.95):]
     gray = cv2.cvtColor(right_crop, cv2.COLOR_BGR2GRAY)
     blurred = cv2.GaussianBlur(gray, (5, 5), 0)
-    _, thresh = cv2.threshold(blurred, 0, 255, cv2.THRESH_BINARY_INV + cv2.THRESH_OTSU)
+    if adaptive:
+        thresh = cv2.adaptiveThreshold(blurred, 255, cv2.ADAPTIVE_THRESH_MEAN_C, cv2.THRESH_BINARY_INV, 151, 20)
+    else:
+        _, thresh = cv2.threshold(blurred, 0, 255, cv2.THRESH_BINARY_INV + cv2.THRESH_OTSU)
     contours, _ = cv2.findContours(thresh, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
     offset_x = int(w * 0.95)
     rects = [(x + w // 2 + offset_x, y + h // 2)
@@ -254,21 +722,45 @@ def generate_student_id_grid(image):
             grid.append((int(round(x)), int(round(y))))
     return grid
 
-def extract_student_id(image, grid_points):
-    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+def student_id_scores(image, grid_points):
+    """Mean brightness of every ID bubble as a 9x10 (column x digit) array; darker means filled."""
+    # Only the ID grid is converted to grayscale, not the whole page.
+    xs, ys = zip(*grid_points)
+    x0, y0 = max(0, min(xs) - bubble_radius), max(0, min(ys) - bubble_radius)
+    x1, y1 = max(xs) + bubble_radius, max(ys) + bubble_radius
+    gray = cv2.cvtColor(image[y0:y1, x0:x1], cv2.COLOR_BGR2GRAY)
+    grid_points = [(x - x0, y - y0) for x, y in grid_points]
     cols = [[] for _ in range(9)]
     for i, (x, y) in enumerate(grid_points):
         cols[i % 9].append((x, y))
     for col in cols:
         col.sort(key=lambda p: p[1])
-    digits = []
-    for col in cols:
-        scores = []
-        for (x, y) in col:
+    scores = np.full((9, 10), np.inf)
+    for c, col in enumerate(cols):
+        for d, (x, y) in enumerate(col):
             roi = gray[y - bubble_radius:y + bubble_radius, x - bubble_radius:x + bubble_radius]
-            scores.append(np.mean(cv2.GaussianBlur(roi, (3, 3), 0)) if roi.size else float("inf"))
-        digits.append(np.argmin(scores))
-    return ''.join(map(str, digits))
+            if roi.size:
+                scores[c, d] = np.mean(cv2.GaussianBlur(roi, (3, 3), 0))
+    return scores
+
+def decode_student_id(scores):
+    return ''.join(map(str, np.argmin(scores, axis=1)))
+
+def digit_confidences(scores):
+    """Brightness gap between the darkest and second darkest bubble of each column, scaled to 0-1."""
+    ordered = np.sort(scores, axis=1)
+    gaps = np.nan_to_num((ordered[:, 1] - ordered[:, 0]) / 255, nan=0.0, posinf=1.0)
+    return [round(float(g), 3) for g in np.clip(gaps, 0, 1)]
+
+def extract_student_id(image, grid_points):
+    return decode_student_id(student_id_scores(image, grid_points))
+
+def page_student_id(image):
+    """The student ID read with the standard settings, or None if the ID markers cannot be found."""
+    try:
+        return extract_student_id(image, generate_student_id_grid(image))
+    except ValueError:
+        return None
 
 if __name__ == "__main__":
     main()
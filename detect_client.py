@@ -0,0 +1,29 @@
+import json
+import urllib.request
+
+# --- Settings ---
+# Keep in sync with detect_server.py; the client deliberately avoids importing OpenCV.
+host = "127.0.0.1"
+port = 8765
+
+def detect(file_path, url=f"http://{host}:{port}/detect"):
+    with open(file_path, "rb") as f:
+        data = f.read()
+    content_type = "application/pdf" if data.startswith(b"%PDF") else "application/octet-stream"
+    request = urllib.request.Request(url, data=data, headers={"Content-Type": content_type})
+    with urllib.request.urlopen(request) as response:
+        return json.load(response)
+
+def main():
+    file_path = input("Enter the path to a scanned page (PNG/JPEG) or PDF: ").strip()
+    result = detect(file_path)
+    for page in result["pages"]:
+        if page["error"]:
+            print(f"❌ Page {page['page']}: {page['error']}")
+        else:
+            print(f"✅ Page {page['page']}: ID {page['student_id']} - {''.join(page['answers'])}")
+            print(f"   Lowest answer confidence: {min(page['answer_confidences']):.3f}")
+    print(f"\n⏱️ Server time: {result['elapsed_ms']} ms")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,136 @@
+import os
+import json
+import time
+from multiprocessing import Pool
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import cv2
+import numpy as np
+import fitz  # PyMuPDF
+from detect_answers import load_calibration, detect_sheet, make_buffers
+from process_pdf import render_page_array
+
+# --- Settings ---
+host = "127.0.0.1"
+port = 8765
+
+# === Worker Side ===
+# Each worker process loads the calibration once and keeps it, along with its
+# reusable image buffers, for every request.
+worker_calibration = None
+worker_buffers = None
+
+def init_worker(folder):
+    global worker_calibration, worker_buffers
+    worker_calibration = load_calibration(folder)
+    worker_buffers = make_buffers()
+
+def detect_image(img, page=1):
+    try:
+        result = detect_sheet(img, worker_calibration, worker_buffers)
+        result.pop("annotated")
+        # The raw ID bubble scores are only needed for roster matching in process_answers.py,
+        # and empty bubble crops score inf, which json.dumps would write as invalid JSON.
+        result.pop("student_id_scores")
+        return {"page": page, **result, "error": None}
+    except Exception as e:
+        return {"page": page, "error": str(e)}
+
+def detect_image_bytes(data):
+    img = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_COLOR)
+    if img is None:
+        return [{"page": 1, "error": "Could not decode image."}]
+    return [detect_image(img)]
+
+def detect_pdf(pool, doc):
+    """Render each page once here and send only its pixels to a worker, so the PDF itself is never copied.
+
+    Pages are queued as soon as they are rendered, so workers detect earlier pages while
+    later ones render. A page that fails to render or detect gets its own error entry.
+    """
+    jobs = []
+    for page_num in range(len(doc)):
+        try:
+            img = render_page_array(doc, page_num)
+            jobs.append((page_num + 1, pool.apply_async(detect_image, (img, page_num + 1))))
+        except Exception as e:
+            jobs.append((page_num + 1, e))
+
+    pages = []
+    for page, job in jobs:
+        try:
+            if isinstance(job, Exception):
+                raise job
+            pages.append(job.get())
+        except Exception as e:
+            pages.append({"page": page, "error": str(e)})
+    return pages
+
+# === HTTP Side ===
+def make_handler(pool):
+    class DetectHandler(BaseHTTPRequestHandler):
+        def _send_json(self, status, payload):
+            body = json.dumps(payload).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            if self.path == "/health":
+                self._send_json(200, {"status": "ok"})
+            else:
+                self._send_json(404, {"error": "Not found"})
+
+        def do_POST(self):
+            if self.path != "/detect":
+                self._send_json(404, {"error": "Not found"})
+                return
+            data = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+            if not data:
+                self._send_json(400, {"error": "Empty request body."})
+                return
+
+            start = time.perf_counter()
+            if data.startswith(b"%PDF"):
+                try:
+                    doc = fitz.open(stream=data, filetype="pdf")
+                except Exception as e:
+                    self._send_json(400, {"error": f"Could not open PDF: {e}"})
+                    return
+                with doc:
+                    pages = detect_pdf(pool, doc)
+            else:
+                pages = pool.apply(detect_image_bytes, (data,))
+
+            self._send_json(200, {
+                "pages": pages,
+                "elapsed_ms": round(1000 * (time.perf_counter() - start), 1),
+            })
+
+        def log_message(self, format, *args):
+            pass
+
+    return DetectHandler
+
+def serve(folder, workers=None):
+    # Calibrate up front so workers never fall into the interactive calibration.
+    load_calibration(folder)
+    workers = workers or os.cpu_count()
+    with Pool(workers, initializer=init_worker, initargs=(folder,)) as pool:
+        server = ThreadingHTTPServer((host, port), make_handler(pool))
+        print(f"🚀 Detection service ready on http://{host}:{port}/detect with {workers} warm workers (Ctrl+C to stop)")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            print("\n🛑 Detection service stopped.")
+        finally:
+            server.server_close()
+
+def main():
+    folder = input("📂 Enter the folder containing bubble_coords.csv and min_roi_size.txt: ").strip()
+    workers = input(f"How many workers? (default {os.cpu_count()}): ").strip()
+    serve(folder, int(workers) if workers else None)
+
+if __name__ == "__main__":
+    main()
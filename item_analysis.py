@@ -1,18 +1,22 @@
+import numpy as np
 import pandas as pd
 from scipy.stats import pointbiserialr
+from concurrent.futures import ProcessPoolExecutor
 import matplotlib.pyplot as plt
-from reportlab.lib.pagesizes import A4
-from reportlab.platypus import (
-    BaseDocTemplate, Frame, PageTemplate, Table, TableStyle,
-    Paragraph, Spacer, PageBreak, Image as RLImage
-)
-from reportlab.lib import colors
+from reportlab.platypus import Table, TableStyle, Paragraph, Spacer, PageBreak, Image as RLImage
 from reportlab.lib.styles import getSampleStyleSheet
-from reportlab.lib.units import inch
-from reportlab.lib.utils import ImageReader
 import os
 import tempfile
 import datetime
+from results_store import CSV_NAME, load_store, store_to_dataframe, split_answer_key
+from report_common import TABLE_STYLE, university_logo, title_page, build_report
+
+# --- Bootstrap Settings ---
+bootstrap_resamples = 10000
+bootstrap_batch_size = 500   # resamples computed together as one matrix product
+bootstrap_seed = 12345       # fixed, so re-running a report gives the same intervals
+bootstrap_workers = None     # processes (None = one per CPU core)
+confidence_level = 0.95
 
 def interpret_difficulty(p):
     if p >= 0.9:
@@ -40,6 +44,125 @@ def interpret_discrimination(r_pb):
     else:
         return "Negative (Bad)"
 
+def kr20(correct):
+    """KR-20 reliability of a students x items matrix of 0/1 scores."""
+    k = correct.shape[1]
+    p = correct.mean(axis=0)
+    total_var = correct.sum(axis=1).var()
+    return k / (k - 1) * (1 - np.sum(p * (1 - p)) / total_var) if k > 1 and total_var > 0 else np.nan
+
+def bootstrap_batch(correct, seed, size):
+    """p, r_pb and KR-20 for a batch of bootstrap resamples of the students.
+
+    Each resample is a row of counts saying how often each student was drawn, so every
+    statistic for the whole batch is a matrix product with the 0/1 score matrix.
+    """
+    n, k = correct.shape
+    rng = np.random.default_rng(seed)
+    weights = rng.multinomial(n, np.full(n, 1 / n), size=size) / n
+    totals = correct.sum(axis=1)
+
+    p = weights @ correct
+    mean_total = weights @ totals
+    var_total = weights @ totals ** 2 - mean_total ** 2
+    cov = weights @ (correct * totals[:, None]) - p * mean_total[:, None]
+    item_var = p * (1 - p)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        r_pb = cov / np.sqrt(item_var * var_total[:, None])
+        reliability = k / (k - 1) * (1 - item_var.sum(axis=1) / var_total)
+    return p, r_pb, reliability
+
+def bootstrap_intervals(correct, resamples=None, seed=None, workers=None):
+    """Percentile confidence intervals for every item's p and r_pb, and for KR-20.
+
+    Batches get their own child seeds, so the result does not depend on the number of workers.
+    """
+    resamples = resamples or bootstrap_resamples
+    seed = bootstrap_seed if seed is None else seed
+    sizes = [min(bootstrap_batch_size, resamples - start) for start in range(0, resamples, bootstrap_batch_size)]
+    seeds = np.random.SeedSequence(seed).spawn(len(sizes))
+    correct = np.asarray(correct, dtype=np.float64)
+
+    with ProcessPoolExecutor(workers or bootstrap_workers) as pool:
+        batches = list(pool.map(bootstrap_batch, [correct] * len(sizes), seeds, sizes))
+    p, r_pb, reliability = (np.concatenate(parts) for parts in zip(*batches))
+
+    tail = 100 * (1 - confidence_level) / 2
+    def interval(samples):
+        with np.errstate(invalid="ignore"):
+            valid = np.isfinite(samples).any(axis=0)
+            low, high = np.full(samples.shape[1:], np.nan), np.full(samples.shape[1:], np.nan)
+            low[valid], high[valid] = np.nanpercentile(samples[:, valid], [tail, 100 - tail], axis=0)
+        return low, high
+    return {
+        "p": interval(p),
+        "r_pb": interval(r_pb),
+        "kr20": interval(reliability[:, None]),
+    }
+
+def format_interval(low, high):
+    return "N/A" if np.isnan(low) or np.isnan(high) else f"[{low:.2f}, {high:.2f}]"
+
+def item_statistics(correct_matrix, questions, with_intervals=False):
+    """Item statistics for a students x questions matrix of 0/1 scores.
+
+    Returns the table for the CSV, the table for the PDF (with any intervals folded
+    into the value cells) and the KR-20 text for the summary.
+    """
+    totals = correct_matrix.sum(axis=1)
+    item_stats = []
+    for j, q in enumerate(questions):
+        correct_col = correct_matrix[:, j]
+        difficulty = correct_col.mean()
+        r_pb = None
+        if len(np.unique(correct_col)) > 1:
+            r_pb, _ = pointbiserialr(correct_col, totals)
+        item_stats.append({
+            'Question': int(q),
+            'Difficulty (p)': round(difficulty, 3),
+            'Difficulty Label': interpret_difficulty(difficulty),
+            'Discrimination (r_pb)': round(r_pb, 3) if r_pb is not None else 'N/A',
+            'Discrimination Label': interpret_discrimination(r_pb)
+        })
+
+    item_df = pd.DataFrame(item_stats).sort_values(by='Question')
+    reliability = kr20(correct_matrix)
+    reliability_text = "N/A" if np.isnan(reliability) else f"{reliability:.3f}"
+    pdf_item_df = item_df
+
+    if with_intervals:
+        print(f"\n🎲 Bootstrapping {bootstrap_resamples:,} resamples...")
+        intervals = bootstrap_intervals(correct_matrix)
+        level = f"{confidence_level:.0%}"
+        # item_df follows the order of questions, which is already sorted.
+        for stat, column in [("p", "Difficulty"), ("r_pb", "Discrimination")]:
+            low, high = intervals[stat]
+            item_df[f'{column} {level} CI Low'] = np.round(low, 3)
+            item_df[f'{column} {level} CI High'] = np.round(high, 3)
+
+        pdf_item_df = item_df[['Question', 'Difficulty (p)', 'Difficulty Label',
+                               'Discrimination (r_pb)', 'Discrimination Label']].copy()
+        for stat, column in [("p", "Difficulty (p)"), ("r_pb", "Discrimination (r_pb)")]:
+            low, high = intervals[stat]
+            pdf_item_df[column] = [f"{value}\n{format_interval(l, h)}"
+                                   for value, l, h in zip(pdf_item_df[column], low, high)]
+        low, high = intervals["kr20"]
+        reliability_text += f" ({level} CI {format_interval(low[0], high[0])})"
+
+    return item_df, pdf_item_df, reliability_text
+
+def summary_statistics(total_scores, num_questions, reliability_text):
+    percent_scores = 100 * pd.Series(total_scores) / num_questions
+    return {
+        "Number of students": len(percent_scores),
+        "Max score (%)": "100.00",
+        "Mean score (%)": round(percent_scores.mean(), 2),
+        "Median score (%)": round(percent_scores.median(), 2),
+        "Highest score (%)": round(percent_scores.max(), 2),
+        "Lowest score (%)": round(percent_scores.min(), 2),
+        "KR-20 reliability": reliability_text,
+    }
+
 def generate_score_histogram(df, output_path):
     plt.figure(figsize=(6, 4))
     scores = 100 * df['total_score'] / df['total_score'].max()
@@ -54,30 +177,11 @@ def generate_score_histogram(df, output_path):
 
 def generate_pdf(output_path, summary, item_df, histogram_path,
                  heading, subheading, author, course_name, assessment_name,
-                 staple_logo_path, uni_logo_path):
+                 staple_logo_path, uni_logo_path, show_intervals=False):
 
     pdf_path = os.path.splitext(output_path)[0] + ".pdf"
     styles = getSampleStyleSheet()
-    elements = []
-
-    # Title Page
-    elements.append(RLImage(uni_logo_path, width=2 * inch, height=2 * inch, kind='proportional'))
-    elements.append(Spacer(1, 24))
-    elements.append(RLImage(staple_logo_path, width=1.7 * inch, height=1.7 * inch, kind='proportional'))
-    elements.append(Spacer(1, 24))
-    elements.append(Paragraph(heading, styles['Title']))
-    elements.append(Spacer(1, 6))
-    elements.append(Paragraph(subheading, styles['Normal']))
-    elements.append(Spacer(1, 6))
-    elements.append(Paragraph(f"Assessment: {assessment_name}", styles['Normal']))
-    elements.append(Spacer(1, 6))
-    elements.append(Paragraph(author, styles['Normal']))
-    elements.append(Spacer(1, 24))
-    elements.append(Paragraph(
-        "Report generated by the S.T.A.P.L.E. system, designed by School of Biosciences' TEL Team, University of Liverpool.",
-        styles['Italic']
-    ))
-    elements.append(PageBreak())
+    elements = title_page(heading, subheading, author, assessment_name, staple_logo_path, uni_logo_path)
 
     # Summary Statistics
     elements.append(Paragraph("Summary Statistics", styles['Heading2']))
@@ -94,18 +198,7 @@ def generate_pdf(output_path, summary, item_df, histogram_path,
     elements.append(Paragraph("Item Statistics", styles['Heading2']))
     table_data = [item_df.columns.tolist()] + item_df.astype(str).values.tolist()
     table = Table(table_data, repeatRows=1)
-    table.setStyle(TableStyle([
-        ('BACKGROUND', (0, 0), (-1, 0), colors.HexColor("#003366")),
-        ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
-        ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
-        ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
-        ('FONTNAME', (0, 1), (-1, -1), 'Helvetica'),
-        ('FONTSIZE', (0, 0), (-1, 0), 10),
-        ('FONTSIZE', (0, 1), (-1, -1), 9),
-        ('BOTTOMPADDING', (0, 0), (-1, 0), 6),
-        ('TOPPADDING', (0, 1), (-1, -1), 4),
-        ('GRID', (0, 0), (-1, -1), 0.25, colors.grey),
-    ]))
+    table.setStyle(TableStyle(TABLE_STYLE))
     elements.append(table)
     elements.append(PageBreak())
 
@@ -128,36 +221,15 @@ def generate_pdf(output_path, summary, item_df, histogram_path,
         ("Very Weak", "Little to no value (r = 0.00–0.09)."),
         ("Negative (Bad)", "Inverse relationship — may be flawed or misleading."),
     ]]
+    if show_intervals:
+        elements.append(Spacer(1, 12))
+        elements.append(Paragraph(
+            f"<b>Confidence intervals</b>: The bracketed ranges are {confidence_level:.0%} bootstrap confidence intervals "
+            f"from {bootstrap_resamples:,} resamples of the students. Labels are based on the point estimate; "
+            "if an item's interval spans more than one band, its label may reflect noise rather than a real problem "
+            "with the item, especially in small cohorts.", styles['Normal']))
 
-    def add_footer(canvas, doc):
-        footer_text = "For more information about the S.T.A.P.L.E. system please contact Dr. Robert Treharne (R.Treharne@liverpool.ac.uk)."
-        canvas.saveState()
-        canvas.setFont('Helvetica-Oblique', 7)
-        canvas.setFillColor(colors.grey)
-        canvas.drawCentredString(A4[0] / 2, 20, footer_text)
-
-        # STAPLE logo with preserved aspect ratio
-        staple_img = ImageReader(staple_logo_path)
-        orig_width, orig_height = staple_img.getSize()
-        display_width = 45
-        aspect = orig_height / orig_width
-        display_height = display_width * aspect
-        canvas.drawImage(staple_logo_path,
-                         A4[0] - display_width - 10,
-                         5,
-                         width=display_width,
-                         height=display_height,
-                         mask='auto')
-        canvas.drawRightString(A4[0] - display_width - 14, 20, f"Page {doc.page}")
-        canvas.restoreState()
-
-    doc = BaseDocTemplate(pdf_path, pagesize=A4)
-    frame = Frame(doc.leftMargin, doc.bottomMargin + 30, doc.width, doc.height - 40, id='normal')
-    template = PageTemplate(id='with-footer', frames=frame, onPage=add_footer)
-    doc.addPageTemplates([template])
-    doc.build(elements)
-
-    print(f"\n📄 PDF report saved to: {pdf_path}")
+    build_report(pdf_path, elements, staple_logo_path)
 
 def main():
     file_path = input("Enter the path to the CSV file containing raw answers: ").strip()
@@ -165,6 +237,7 @@ def main():
     author_name = input("Enter the name of the person generating the report: ").strip()
     course_name = input("Enter the course name: ").strip()
     assessment_name = input("Enter the assessment name: ").strip()
+    with_intervals = input("Compute bootstrap confidence intervals for the item statistics? (y/n): ").strip().lower() == 'y'
 
     folder_title = os.path.basename(os.path.dirname(file_path)).replace("_", " ").title()
     report_date = datetime.datetime.now().strftime("%d %B %Y")
@@ -172,15 +245,19 @@ def main():
     report_subheading = f"Course: {course_name}"
     report_author = f"Report generated by {author_name} on {report_date}"
 
-    df = pd.read_csv(file_path)
-    answer_rows = df[df['filename'].str.contains("answers", case=False, na=False)]
-    if answer_rows.empty:
+    if os.path.basename(file_path) == CSV_NAME:
+        # Detection output: load the memory-mapped columnar store instead of re-parsing the CSV.
+        df = store_to_dataframe(load_store(os.path.dirname(file_path) or "."))
+    else:
+        df = pd.read_csv(file_path)
+    key_row, student_rows = split_answer_key(df['filename'].fillna('').to_numpy(dtype=str))
+    if key_row is None:
         print("\n❌ No row found where 'filename' contains 'answers'.")
         print("Here are the first few filenames in your file:")
         print(df['filename'].head(10).to_string(index=False))
         return
 
-    answer_row = answer_rows.iloc[0]
+    answer_row = df.iloc[key_row]
     correct_answers = {
         str(col): answer_row[col]
         for col in df.columns
@@ -190,38 +267,16 @@ def main():
     selected_qs = sorted(correct_answers.keys(), key=lambda x: int(x))[:num_questions]
     correct_answers = {q: correct_answers[q] for q in selected_qs}
 
-    df = df[~df['filename'].str.contains("answers", case=False, na=False)].copy()
+    df = df.iloc[student_rows].copy()
 
     for q in correct_answers:
         df[f'Q{q}_correct'] = df[q] == correct_answers[q]
 
     df['total_score'] = df[[f'Q{q}_correct' for q in correct_answers]].sum(axis=1)
 
-    item_stats = []
-    for q in correct_answers:
-        correct_col = f'Q{q}_correct'
-        difficulty = df[correct_col].mean()
-        r_pb = None
-        if df[correct_col].nunique() > 1:
-            r_pb, _ = pointbiserialr(df[correct_col], df['total_score'])
-        item_stats.append({
-            'Question': int(q),
-            'Difficulty (p)': round(difficulty, 3),
-            'Difficulty Label': interpret_difficulty(difficulty),
-            'Discrimination (r_pb)': round(r_pb, 3) if r_pb is not None else 'N/A',
-            'Discrimination Label': interpret_discrimination(r_pb)
-        })
-
-    item_df = pd.DataFrame(item_stats).sort_values(by='Question')
-    percent_scores = 100 * df['total_score'] / len(correct_answers)
-    summary = {
-        "Number of students": len(df),
-        "Max score (%)": "100.00",
-        "Mean score (%)": round(percent_scores.mean(), 2),
-        "Median score (%)": round(percent_scores.median(), 2),
-        "Highest score (%)": round(percent_scores.max(), 2),
-        "Lowest score (%)": round(percent_scores.min(), 2),
-    }
+    correct_matrix = df[[f'Q{q}_correct' for q in correct_answers]].to_numpy(dtype=float)
+    item_df, pdf_item_df, reliability_text = item_statistics(correct_matrix, list(correct_answers), with_intervals)
+    summary = summary_statistics(df['total_score'], len(correct_answers), reliability_text)
 
     print("\n=== ITEM ANALYSIS SUMMARY ===")
     for k, v in summary.items():
@@ -239,14 +294,10 @@ def main():
         histogram_path = tmp_img.name
     generate_score_histogram(df, histogram_path)
 
-    # Convert SVG university logo to PNG if needed
-    uni_logo_png = "logo_converted.png"
-
-
     generate_pdf(
-        output_csv, summary, item_df, histogram_path,
+        output_csv, summary, pdf_item_df, histogram_path,
         report_heading, report_subheading, report_author, course_name,
-        assessment_name, "staple.png", uni_logo_png
+        assessment_name, "staple.png", university_logo(), show_intervals=with_intervals
     )
 
 if __name__ == "__main__":
@@ -0,0 +1,120 @@
+import os
+import csv
+import cv2
+import numpy as np
+
+# --- Settings ---
+hash_scale = 8              # pages are hashed at 1/8 resolution
+hash_width, hash_height = 48, 68
+duplicate_similarity = 0.4  # Jaccard similarity of hash bits above which two pages are duplicates
+min_background_pages = 5    # pages needed before the shared form can be subtracted reliably
+background_sample = 101     # at most this many indexed pages are used to estimate the form
+
+# Each page is reduced to a small "ink map" in a frame aligned to the red ROI box, which
+# makes it robust to the shifts and small rotations between two scans of the same sheet.
+# The red channel is used so any red-printed parts of the form drop out.
+def ink_map(image):
+    small = cv2.resize(image, (image.shape[1] // hash_scale, image.shape[0] // hash_scale),
+                       interpolation=cv2.INTER_AREA)
+    hsv = cv2.cvtColor(small, cv2.COLOR_BGR2HSV)
+    mask = cv2.inRange(hsv, np.array([0, 100, 50]), np.array([15, 255, 255])) | \
+        cv2.inRange(hsv, np.array([160, 100, 50]), np.array([180, 255, 255]))
+    contours, _ = cv2.findContours(mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+    if not contours:
+        return None
+
+    corners = cv2.boxPoints(cv2.minAreaRect(max(contours, key=cv2.contourArea)))
+    s = corners.sum(axis=1)
+    diff = np.diff(corners, axis=1).ravel()
+    tl, tr, bl = corners[np.argmin(s)], corners[np.argmin(diff)], corners[np.argmax(diff)]
+
+    # Map the box to the lower half of the hash frame, leaving the ID area above it in view.
+    w, h = hash_width * 4, hash_height * 4
+    dst = np.float32([[0.1 * w, 0.45 * h], [0.9 * w, 0.45 * h], [0.1 * w, 0.95 * h]])
+    M = cv2.getAffineTransform(np.float32([tl, tr, bl]), dst)
+    ink = cv2.warpAffine(255 - small[:, :, 2], M, (w, h), flags=cv2.INTER_AREA, borderValue=0)
+    return cv2.resize(ink, (hash_width, hash_height), interpolation=cv2.INTER_AREA).ravel()
+
+def page_hashes(maps, background):
+    """Hash bits marking where each page has clearly more ink than the shared form (the background)."""
+    residual = maps.astype(np.float32) - background
+    return residual > (residual.mean(axis=-1, keepdims=True) + residual.std(axis=-1, keepdims=True))
+
+def similarity(hashes, h):
+    """Jaccard similarity between one hash and each row of a hash array."""
+    both = (hashes & h).sum(axis=-1)
+    either = (hashes | h).sum(axis=-1)
+    return both / np.maximum(either, 1)
+
+# === Persistent Index ===
+def load_hash_index(folder):
+    index_path = os.path.join(folder, "page_hashes.npz")
+    if not os.path.exists(index_path):
+        return {"filenames": [], "student_ids": [], "maps": np.zeros((0, hash_width * hash_height), dtype=np.uint8)}
+    with np.load(index_path) as data:
+        filenames = list(data["filenames"])
+        # Indexes written before student IDs were recorded match nothing until re-indexed.
+        student_ids = list(data["student_ids"]) if "student_ids" in data else [""] * len(filenames)
+        return {"filenames": filenames, "student_ids": student_ids, "maps": data["maps"]}
+
+def save_hash_index(folder, index):
+    np.savez(os.path.join(folder, "page_hashes.npz"), filenames=np.array(index["filenames"], dtype=str),
+             student_ids=np.array(index["student_ids"], dtype=str), maps=index["maps"])
+
+def forget_pages(index, filenames):
+    """Drop pages that are about to be re-processed, so they are only matched against earlier pages."""
+    drop = set(filenames)
+    keep = [i for i, f in enumerate(index["filenames"]) if f not in drop]
+    index["filenames"] = [index["filenames"][i] for i in keep]
+    index["student_ids"] = [index["student_ids"][i] for i in keep]
+    index["maps"] = index["maps"][keep]
+
+def match_page(index, image, student_id):
+    """Return (ink map, duplicate_of, similarity) for a page's closest match in the index.
+
+    Students who give the same answers leave near-identical marks, so only indexed pages
+    with the same student ID count as matches; a page whose ID could not be read
+    (student_id None) is never flagged. The page itself is not added; call index_page
+    once it has been detected, so a sheet that failed detection is never the reason its
+    re-scan is flagged or skipped. Until min_background_pages pages are indexed the form
+    cannot be estimated, so nothing is flagged.
+    """
+    m = ink_map(image)
+    if m is None:
+        return None, None, 0.0
+
+    filenames, maps = index["filenames"], index["maps"]
+    duplicate_of, best = None, 0.0
+    same_id = np.array([s == student_id for s in index["student_ids"]], dtype=bool)
+    if len(filenames) >= min_background_pages and student_id and same_id.any():
+        step = max(1, len(maps) // background_sample)
+        background = np.median(maps[::step], axis=0)
+        scores = np.where(same_id, similarity(page_hashes(maps, background), page_hashes(m, background)), 0.0)
+        i = int(np.argmax(scores))
+        best = float(scores[i])
+        if best >= duplicate_similarity:
+            duplicate_of = filenames[i]
+    return m, duplicate_of, round(best, 3)
+
+def index_page(index, filename, ink, student_id):
+    if ink is None:
+        return
+    forget_pages(index, [filename])
+    index["filenames"].append(filename)
+    index["student_ids"].append(student_id)
+    index["maps"] = np.vstack([index["maps"], ink])
+
+def record_duplicates(folder, duplicates, checked_filenames):
+    """Update duplicate_scans.csv, replacing earlier entries for every page checked in this run."""
+    duplicates_path = os.path.join(folder, "duplicate_scans.csv")
+    checked = set(checked_filenames)
+    rows = []
+    if os.path.exists(duplicates_path):
+        with open(duplicates_path, newline="") as f:
+            rows = [r for r in csv.reader(f)][1:]
+    rows = [r for r in rows if r and r[0] not in checked] + [list(d) for d in duplicates]
+
+    with open(duplicates_path, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(["filename", "duplicate_of", "similarity"])
+        writer.writerows(rows)
@@ -0,0 +1,135 @@
+import os
+import csv
+import cv2
+import numpy as np
+
+# Rendered pages can be kept as raw BGR pixels in one file instead of as PNGs. Each page
+# is a fixed-shape uint8 array at a known offset, so reading a page is a memory-mapped
+# slice with no decoding, and worker processes reading the same store share the OS page
+# cache. Pages keep their page_XXX.png names so every other output (annotated images,
+# ID thumbnails, results CSVs) looks the same whichever format the pages are stored in.
+PAGE_DATA = "pages.raw"
+PAGE_INDEX = "pages_index.csv"
+
+open_stores = {}   # folder -> (size of pages.raw when mapped, memmap)
+page_indexes = {}  # folder -> (mtime and size of pages_index.csv when read, index)
+
+def load_page_index(folder):
+    """Return {filename: (offset, height, width)} for every page in the store (empty if there is none)."""
+    index_path = os.path.join(folder, PAGE_INDEX)
+    if not os.path.exists(index_path):
+        return {}
+    stat = os.stat(index_path)
+    signature = (stat.st_mtime_ns, stat.st_size)
+    cached = page_indexes.get(folder)
+    if cached and cached[0] == signature:
+        return cached[1]
+    with open(index_path, newline="") as f:
+        index = {row["filename"]: (int(row["offset"]), int(row["height"]), int(row["width"]))
+                 for row in csv.DictReader(f)}
+    page_indexes[folder] = (signature, index)
+    return index
+
+def append_pages(folder, pages):
+    """Add (filename, BGR array) pairs to the store. A page added again replaces the earlier copy."""
+    os.makedirs(folder, exist_ok=True)
+    data_path = os.path.join(folder, PAGE_DATA)
+    index_path = os.path.join(folder, PAGE_INDEX)
+    new_index = not os.path.exists(index_path)
+
+    # Pixels are written before the index rows that point at them, so a reader never
+    # sees an index entry for data that is not there yet.
+    rows = []
+    with open(data_path, "ab") as data:
+        for filename, img in pages:
+            img = np.ascontiguousarray(img, dtype=np.uint8)
+            rows.append((filename, data.tell(), img.shape[0], img.shape[1]))
+            data.write(img.tobytes())
+
+    with open(index_path, "a", newline="") as f:
+        writer = csv.writer(f)
+        if new_index:
+            writer.writerow(["filename", "offset", "height", "width"])
+        writer.writerows(rows)
+
+def clear_pages(folder):
+    """Remove the store, e.g. before rendering a fresh batch of scans into the same folder."""
+    for name in (PAGE_DATA, PAGE_INDEX):
+        path = os.path.join(folder, name)
+        if os.path.exists(path):
+            os.remove(path)
+    open_stores.pop(folder, None)
+    page_indexes.pop(folder, None)
+
+def _page_map(folder, end):
+    size, mapped = open_stores.get(folder, (0, None))
+    if mapped is None or end > size:
+        size = os.path.getsize(os.path.join(folder, PAGE_DATA))
+        mapped = np.memmap(os.path.join(folder, PAGE_DATA), dtype=np.uint8, mode="r")
+        open_stores[folder] = (size, mapped)
+    return mapped
+
+def png_pages(folder):
+    if not os.path.isdir(folder):
+        return set()
+    return {f for f in os.listdir(folder) if f.lower().endswith(".png")}
+
+def check_page_format(folder, use_store):
+    """Refuse to add pages in one format to a folder that already has pages in the other.
+
+    A stored page is read in preference to a PNG of the same name, so mixing the two
+    would silently give stale pages.
+    """
+    if use_store and png_pages(folder):
+        raise FileExistsError(f"{folder} already contains PNG pages. Use an empty folder for the page store.")
+    if not use_store and load_page_index(folder):
+        raise FileExistsError(f"{folder} already contains a page store ({PAGE_DATA}). Use an empty folder for PNG pages.")
+
+def list_pages(folder):
+    """Sorted names of every page in a folder, whether stored as PNG files or in the page store."""
+    return sorted(png_pages(folder) | set(load_page_index(folder)))
+
+def has_page(folder, filename):
+    return filename in load_page_index(folder) or os.path.isfile(os.path.join(folder, filename))
+
+def read_page(folder, filename, index=None):
+    """Return a page as a BGR array: a read-only view into the store, or a decoded PNG."""
+    index = load_page_index(folder) if index is None else index
+    if filename in index:
+        offset, height, width = index[filename]
+        nbytes = height * width * 3
+        mapped = _page_map(folder, offset + nbytes)
+        return mapped[offset:offset + nbytes].reshape(height, width, 3)
+
+    img = cv2.imread(os.path.join(folder, filename))
+    if img is None:
+        raise ValueError("Could not read image.")
+    return img
+
+def page_shape(folder, filename, index=None):
+    """(height, width) of a page, read from the store index without touching the pixels where possible."""
+    index = load_page_index(folder) if index is None else index
+    if filename in index:
+        return index[filename][1:]
+    return read_page(folder, filename, index).shape[:2]
+
+def export_pngs(folder, filenames=None, output_folder=None):
+    """Write stored pages out as PNG files, e.g. to share them or inspect them in an image viewer."""
+    index = load_page_index(folder)
+    output_folder = output_folder or os.path.join(folder, "png_export")
+    os.makedirs(output_folder, exist_ok=True)
+    for filename in filenames or sorted(index):
+        cv2.imwrite(os.path.join(output_folder, filename), read_page(folder, filename, index))
+    print(f"✅ Exported {len(filenames or index)} pages to {output_folder}")
+
+def main():
+    folder = input("📂 Enter folder with the page store: ").strip()
+    if not load_page_index(folder):
+        print("No page store found in that folder.")
+        return
+    # Exporting next to the store would leave the folder holding both formats.
+    output_folder = input("Enter the output folder for PNG images (blank = png_export inside that folder): ").strip()
+    export_pngs(folder, output_folder=output_folder or os.path.join(folder, "png_export"))
+
+if __name__ == "__main__":
+    main()
@@ -1,25 +1,79 @@
 import csv
 import os
 import re
-from PIL import Image
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+from PIL import Image, ImageDraw
 import matplotlib.pyplot as plt
+from results_store import load_store, split_answer_key, matches_key
+from page_store import has_page, read_page
+from roster_match import match_roster, is_confident
 
 current_figure = None  # Global reference to the active image figure
+prefetch_depth = 3  # ID crops loaded in the background ahead of the one being resolved
+prefetch_pool = ThreadPoolExecutor(max_workers=2)
+pending_crops = {}
 
-def open_image(filepath):
-    """Open only the top 25% of the image using matplotlib."""
+def id_thumbnail_path(directory, filename):
+    return os.path.join(directory, 'id_thumbs', os.path.splitext(filename)[0] + '.jpg')
+
+def load_id_crop(directory, filename):
+    """Load the cached ID thumbnail, falling back to cropping the top 25% of the full scan."""
+    thumb_path = id_thumbnail_path(directory, filename)
+    if os.path.isfile(thumb_path):
+        with Image.open(thumb_path) as img:
+            return img.convert('RGB')
+    page = read_page(directory, filename)
+    return Image.fromarray(np.ascontiguousarray(page[:int(0.25 * page.shape[0]), :, ::-1]))
+
+def has_id_image(directory, filename):
+    return os.path.isfile(id_thumbnail_path(directory, filename)) or has_page(directory, filename)
+
+def prefetch_id_crops(directory, filenames):
+    for filename in filenames:
+        if filename not in pending_crops and has_id_image(directory, filename):
+            pending_crops[filename] = prefetch_pool.submit(load_id_crop, directory, filename)
+
+def open_image(directory, filename):
+    """Show the ID region of a scan, reusing one matplotlib window for every script."""
     global current_figure
     try:
-        img = Image.open(filepath)
-        width, height = img.size
-        top_crop = img.crop((0, 0, width, int(0.25 * height)))
-        current_figure = plt.figure()
+        future = pending_crops.pop(filename, None)
+        top_crop = future.result() if future else load_id_crop(directory, filename)
+        if current_figure is None or not plt.fignum_exists(current_figure.number):
+            current_figure = plt.figure()
+        else:
+            plt.figure(current_figure.number)
+            plt.clf()
         plt.imshow(top_crop)
         plt.axis('off')
-        plt.title(os.path.basename(filepath))
+        plt.title(filename)
         plt.show(block=False)
+        plt.pause(0.001)
     except Exception as e:
-        print(f"⚠️ Could not open image {filepath}: {e}")
+        print(f"⚠️ Could not open image {filename}: {e}")
+
+def build_contact_sheet(directory, filenames, output_path, columns=3, tile_width=400):
+    """Tile the ID regions of the given scans into one labelled image."""
+    tiles = []
+    for filename in filenames:
+        if has_id_image(directory, filename):
+            crop = load_id_crop(directory, filename)
+            crop = crop.resize((tile_width, round(crop.height * tile_width / crop.width)))
+            tiles.append((filename, crop))
+    if not tiles:
+        return None
+
+    tile_height = max(crop.height for _, crop in tiles) + 20
+    rows = -(-len(tiles) // columns)
+    sheet = Image.new('RGB', (columns * tile_width, rows * tile_height), 'white')
+    draw = ImageDraw.Draw(sheet)
+    for i, (filename, crop) in enumerate(tiles):
+        x, y = (i % columns) * tile_width, (i // columns) * tile_height
+        sheet.paste(crop, (x, y + 20))
+        draw.text((x + 4, y + 4), filename, fill='black')
+    sheet.save(output_path)
+    return output_path
 
 def count_digit_differences(a: str, b: str) -> int:
     return sum(x != y for x, y in zip(a.zfill(len(b)), b.zfill(len(a)))) if len(a) == len(b) else 99
@@ -34,6 +88,12 @@ def find_close_student_id(student_id, student_lookup, used_ids):
                 return known_id, name
     return None, None
 
+def roster_suggestion(scores, student_lookup, used_ids):
+    """Most likely unused roster ID for a sheet's ID bubble scores, with its margin and fit deficit."""
+    if scores is None:
+        return None, None, None
+    return match_roster(scores, [s for s in student_lookup if s not in used_ids])
+
 def score_answers():
     directory = input("Enter the path to the directory containing all_detected_answers.csv: ").strip()
     input_csv = os.path.join(directory, 'all_detected_answers.csv')
@@ -73,22 +133,20 @@ def score_answers():
         else:
             print(f"⚠️ No file named {lookup_filename} found. Skipping enrichment.")
 
+    store = load_store(directory)
+    id_scores = {}
+    if 'student_id_scores' in store:
+        id_scores = dict(zip(map(str, store['filenames']), store['student_id_scores']))
+
     if not os.path.isfile(output_csv):
-        rows = []
-        answer_key = None
-        with open(input_csv, newline='', encoding='utf-8') as csvfile:
-            reader = csv.reader(csvfile)
-            headers = next(reader)
-            for row in reader:
-                if 'answers' in row[0].lower():
-                    answer_key = row[1:1 + num_questions]
-                else:
-                    rows.append(row)
-
-        if not answer_key:
+        filenames = store['filenames']
+        key_row, student_rows = split_answer_key(filenames)
+        if key_row is None:
             print("❌ No answer key row found.")
             return
 
+        scores = matches_key(store, student_rows, key_row, num_questions).sum(axis=1)
+
         output_headers = ['filename', 'score', 'percentage_score', 'student_id']
         if enrich_success:
             output_headers.insert(1, 'student_name')
@@ -96,12 +154,11 @@ def score_answers():
 
         scored_data = []
         used_ids = set()
-        for row in rows:
-            filename = row[0]
-            student_answers = row[1:1 + num_questions]
-            score = sum(sa == ak for sa, ak in zip(student_answers, answer_key))
+        for i, score in zip(student_rows, scores):
+            filename = str(filenames[i])
+            score = int(score)
             percentage = round(100 * score / num_questions, 1)
-            raw_id = row[-1]
+            raw_id = str(store['student_ids'][i])
 
             out_row = {
                 'filename': filename,
@@ -121,6 +178,25 @@ def score_answers():
 
             scored_data.append(out_row)
 
+        # IDs that did not match exactly are decoded again, constrained to the roster, and
+        # accepted automatically when one roster ID is clearly the best fit.
+        if enrich_success:
+            auto_matched = 0
+            for out_row in scored_data:
+                if out_row['student_name'] != 'Unknown':
+                    continue
+                best, margin, deficit = roster_suggestion(id_scores.get(out_row['filename']), student_lookup, used_ids)
+                if is_confident(margin, deficit):
+                    print(f"🎯 {out_row['filename']}: read as {out_row['student_id']}, matched to {best} (margin {margin})")
+                    out_row['student_name'] = student_lookup[best]
+                    out_row['student_id'] = best
+                    out_row['sis_user_id'] = full_ids.get(best, '')
+                    out_row['ID'] = simple_ids.get(best, '')
+                    used_ids.add(best)
+                    auto_matched += 1
+            if auto_matched:
+                print(f"✅ {auto_matched} IDs matched to the roster automatically.")
+
         with open(output_csv, 'w', newline='', encoding='utf-8') as f:
             writer = csv.DictWriter(f, fieldnames=output_headers)
             writer.writeheader()
@@ -132,20 +208,36 @@ def score_answers():
         headers = rows[0].keys()
 
     used_ids = set(r['student_id'] for r in rows if r['student_name'] != 'Unknown')
+    unresolved = [i for i, row in enumerate(rows) if row['student_name'] == 'Unknown']
 
-    for i, row in enumerate(rows):
-        if row['student_name'] != 'Unknown':
-            continue
+    if unresolved:
+        prefetch_id_crops(directory, [rows[i]['filename'] for i in unresolved[:prefetch_depth]])
+        if input(f"Save a contact sheet of the {len(unresolved)} unresolved ID regions? (y/n): ").strip().lower() == 'y':
+            sheet_path = build_contact_sheet(directory, [rows[i]['filename'] for i in unresolved],
+                                             os.path.join(directory, 'unresolved_ids.jpg'))
+            if sheet_path:
+                print(f"🗂️ Contact sheet saved to: {sheet_path}")
 
+    for n, i in enumerate(unresolved):
+        row = rows[i]
         print(f"\n[{i+1}/{len(rows)}] Resolving: {row['filename']} (ID: {row['student_id']})")
-        image_path = os.path.join(directory, row['filename'])
-        if os.path.isfile(image_path):
-            open_image(image_path)
+        # Start loading the next few scripts while the operator deals with this one.
+        prefetch_id_crops(directory, [rows[j]['filename'] for j in unresolved[n + 1:n + 1 + prefetch_depth]])
+        if has_id_image(directory, row['filename']):
+            open_image(directory, row['filename'])
 
-        suggested_id, suggested_name = find_close_student_id(row['student_id'], student_lookup, used_ids) if enrich_success else (None, None)
+        suggested_id, suggested_name, margin = None, None, None
+        if enrich_success:
+            suggested_id, margin, _ = roster_suggestion(id_scores.get(row['filename']), student_lookup, used_ids)
+            if suggested_id and count_digit_differences(row['student_id'], suggested_id) <= 2:
+                suggested_name = student_lookup[suggested_id]
+            else:
+                suggested_id, suggested_name = find_close_student_id(row['student_id'], student_lookup, used_ids)
+                margin = None
 
         if suggested_id:
-            print(f"🧠 Suggested: {suggested_name} (ID: {suggested_id})")
+            confidence = f", margin {margin}" if margin is not None else ""
+            print(f"🧠 Suggested: {suggested_name} (ID: {suggested_id}{confidence})")
             choice = input("Accept match? (y = yes, m = manual entry): ").strip().lower()
             if choice == 'y':
                 row['student_name'] = suggested_name
@@ -153,8 +245,6 @@ def score_answers():
                 row['sis_user_id'] = full_ids.get(suggested_id, '')
                 row['ID'] = simple_ids.get(suggested_id, '')
                 used_ids.add(suggested_id)
-                if current_figure:
-                    plt.close(current_figure)
                 _update_csv_row(output_csv, row)
                 continue
 
@@ -163,10 +253,10 @@ def score_answers():
         used_ids.add(row['student_id'])
         row['sis_user_id'] = full_ids.get(row['student_id'], '')
         row['ID'] = simple_ids.get(row['student_id'], '')
-        if current_figure:
-            plt.close(current_figure)
         _update_csv_row(output_csv, row)
 
+    if current_figure:
+        plt.close(current_figure)
     print(f"\n✅ Completed. File updated: {output_csv}")
 
 def _update_csv_row(csv_path, updated_row):
@@ -1,5 +1,8 @@
 import os
+import csv
 import fitz  # PyMuPDF
+import numpy as np
+from page_store import append_pages, clear_pages, check_page_format
 
 def merge_pdfs_with_fitz(input_dir, output_pdf_path):
     pdf_files = sorted([f for f in os.listdir(input_dir) if f.lower().endswith(".pdf")])
@@ -18,21 +21,68 @@ def merge_pdfs_with_fitz(input_dir, output_pdf_path):
     merged_doc.close()
     print(f"\n✅ Merged PDF saved to: {output_pdf_path}")
 
-def convert_pdf_to_pngs(pdf_path, output_folder, dpi=300):
+def record_page_sources(output_folder, sources, append=False):
+    sources_path = os.path.join(output_folder, "page_sources.csv")
+    new_file = not (append and os.path.exists(sources_path))
+    with open(sources_path, "a" if append else "w", newline="") as f:
+        writer = csv.writer(f)
+        if new_file:
+            writer.writerow(["filename", "source_pdf", "page"])
+        writer.writerows(sources)
+
+def render_pdf_pages(pdf_path, output_folder, first_page_number=1, dpi=300):
     os.makedirs(output_folder, exist_ok=True)
-    doc = fitz.open(pdf_path)
     zoom = dpi / 72  # default resolution is 72 dpi
     mat = fitz.Matrix(zoom, zoom)
+    sources = []
+
+    with fitz.open(pdf_path) as doc:
+        for page_num in range(len(doc)):
+            page = doc.load_page(page_num)
+            pix = page.get_pixmap(matrix=mat)
+            filename = f"page_{first_page_number + page_num:03}.png"
+            output_path = os.path.join(output_folder, filename)
+            pix.save(output_path)
+            print(f"🖼️ Saved: {output_path}")
+            sources.append((filename, os.path.abspath(pdf_path), page_num + 1))
+
+    return sources
+
+def render_page_array(doc, page_num, dpi=300):
+    """Render one page of an open PDF straight to a BGR array, skipping the PNG round trip."""
+    zoom = dpi / 72
+    pix = doc.load_page(page_num).get_pixmap(matrix=fitz.Matrix(zoom, zoom), alpha=False)
+    rgb = np.frombuffer(pix.samples, dtype=np.uint8).reshape(pix.height, pix.width, pix.n)
+    return np.ascontiguousarray(rgb[:, :, ::-1])
 
-    for page_num in range(len(doc)):
-        page = doc.load_page(page_num)
-        pix = page.get_pixmap(matrix=mat)
-        output_path = os.path.join(output_folder, f"page_{page_num+1:03}.png")
-        pix.save(output_path)
-        print(f"🖼️ Saved: {output_path}")
+def render_pdf_to_store(pdf_path, output_folder, first_page_number=1, dpi=300):
+    """Render pages straight into the memory-mapped page store instead of encoding PNGs."""
+    sources = []
 
-    print(f"\n✅ Converted {len(doc)} pages to PNG images.")
-    doc.close()
+    def rendered_pages(doc):
+        for page_num in range(len(doc)):
+            filename = f"page_{first_page_number + page_num:03}.png"
+            sources.append((filename, os.path.abspath(pdf_path), page_num + 1))
+            yield filename, render_page_array(doc, page_num, dpi)
+
+    with fitz.open(pdf_path) as doc:
+        append_pages(output_folder, rendered_pages(doc))
+    print(f"🗄️ Stored {len(sources)} pages in {output_folder}")
+    return sources
+
+def convert_pdf_to_store(pdf_path, output_folder, dpi=300):
+    check_page_format(output_folder, use_store=True)
+    clear_pages(output_folder)
+    sources = render_pdf_to_store(pdf_path, output_folder, dpi=dpi)
+    record_page_sources(output_folder, sources)
+    print(f"\n✅ Converted {len(sources)} pages into the page store.")
+
+def convert_pdf_to_pngs(pdf_path, output_folder, dpi=300):
+    # A store left from an earlier conversion would otherwise be read instead of the new PNGs.
+    clear_pages(output_folder)
+    sources = render_pdf_pages(pdf_path, output_folder, dpi=dpi)
+    record_page_sources(output_folder, sources)
+    print(f"\n✅ Converted {len(sources)} pages to PNG images.")
 
 def main():
     input_dir = input("Enter the path to the folder containing .pdf files: ").strip()
@@ -42,8 +92,12 @@ def main():
     merged_pdf_path = os.path.join(input_dir, "single.pdf")
     merge_pdfs_with_fitz(input_dir, merged_pdf_path)
 
-    output_img_dir = input("Enter the output folder for PNG images: ").strip()
-    convert_pdf_to_pngs(merged_pdf_path, output_img_dir)
+    output_img_dir = input("Enter the output folder for page images: ").strip()
+    page_format = input("Save pages as PNG files or in the page store? (png/store, default png): ").strip().lower()
+    if page_format == "store":
+        convert_pdf_to_store(merged_pdf_path, output_img_dir)
+    else:
+        convert_pdf_to_pngs(merged_pdf_path, output_img_dir)
 
 if __name__ == "__main__":
     main()
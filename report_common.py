@@ -0,0 +1,90 @@
+import os
+from functools import lru_cache
+from reportlab.platypus import BaseDocTemplate, Frame, PageTemplate, Paragraph, Spacer, PageBreak, Image as RLImage
+from reportlab.lib.pagesizes import A4
+from reportlab.lib import colors
+from reportlab.lib.styles import getSampleStyleSheet
+from reportlab.lib.units import inch
+from reportlab.lib.utils import ImageReader
+
+# Title page, footer and table style shared by the score report and the item analysis report.
+FOOTER_TEXT = "For more information about the S.T.A.P.L.E. system please contact Dr. Robert Treharne (R.Treharne@liverpool.ac.uk)."
+
+TABLE_STYLE = [
+    ('BACKGROUND', (0, 0), (-1, 0), colors.HexColor("#003366")),
+    ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
+    ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
+    ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
+    ('FONTNAME', (0, 1), (-1, -1), 'Helvetica'),
+    ('FONTSIZE', (0, 0), (-1, 0), 10),
+    ('FONTSIZE', (0, 1), (-1, -1), 9),
+    ('BOTTOMPADDING', (0, 0), (-1, 0), 6),
+    ('TOPPADDING', (0, 1), (-1, -1), 4),
+    ('GRID', (0, 0), (-1, -1), 0.25, colors.grey),
+]
+
+def university_logo(svg_path="logo.svg", png_path="logo_converted.png"):
+    """PNG version of the university logo, converted from the SVG only the first time it is needed."""
+    if not os.path.exists(png_path):
+        import cairosvg
+        cairosvg.svg2png(url=svg_path, write_to=png_path)
+    return png_path
+
+@lru_cache(maxsize=None)
+def logo_reader(path):
+    """Load a logo once per process; the footer draws it on every page of every report."""
+    return ImageReader(path)
+
+def title_page(heading, subheading, author, assessment_name, staple_logo_path, uni_logo_path):
+    styles = getSampleStyleSheet()
+    return [
+        RLImage(uni_logo_path, width=2 * inch, height=2 * inch, kind='proportional'),
+        Spacer(1, 24),
+        RLImage(staple_logo_path, width=1.7 * inch, height=1.7 * inch, kind='proportional'),
+        Spacer(1, 24),
+        Paragraph(heading, styles['Title']),
+        Spacer(1, 6),
+        Paragraph(subheading, styles['Normal']),
+        Spacer(1, 6),
+        Paragraph(f"Assessment: {assessment_name}", styles['Normal']),
+        Spacer(1, 6),
+        Paragraph(author, styles['Normal']),
+        Spacer(1, 24),
+        Paragraph(
+            "Report generated by the S.T.A.P.L.E. system, designed by School of Biosciences' TEL Team, University of Liverpool.",
+            styles['Italic']
+        ),
+        PageBreak(),
+    ]
+
+def make_footer(staple_logo_path):
+    staple_img = logo_reader(staple_logo_path)
+
+    def add_footer(canvas, doc):
+        canvas.saveState()
+        canvas.setFont('Helvetica-Oblique', 7)
+        canvas.setFillColor(colors.grey)
+        canvas.drawCentredString(A4[0] / 2, 20, FOOTER_TEXT)
+
+        # STAPLE logo with preserved aspect ratio
+        orig_width, orig_height = staple_img.getSize()
+        display_width = 45
+        display_height = display_width * orig_height / orig_width
+        canvas.drawImage(staple_img,
+                         A4[0] - display_width - 10,
+                         5,
+                         width=display_width,
+                         height=display_height,
+                         mask='auto')
+        canvas.drawRightString(A4[0] - display_width - 14, 20, f"Page {doc.page}")
+        canvas.restoreState()
+
+    return add_footer
+
+def build_report(pdf_path, elements, staple_logo_path):
+    doc = BaseDocTemplate(pdf_path, pagesize=A4)
+    frame = Frame(doc.leftMargin, doc.bottomMargin + 30, doc.width, doc.height - 40, id='normal')
+    template = PageTemplate(id='with-footer', frames=frame, onPage=make_footer(staple_logo_path))
+    doc.addPageTemplates([template])
+    doc.build(elements)
+    print(f"\n📄 PDF report saved to: {pdf_path}")
@@ -0,0 +1,206 @@
+import os
+import csv
+import json
+import numpy as np
+
+# The store is a folder of plain .npy arrays next to all_detected_answers.csv, one file per
+# column, so each column can be memory-mapped without parsing anything.
+STORE_DIR = "all_detected_answers.npcols"
+CSV_NAME = "all_detected_answers.csv"
+
+# Response codes: 0 = blank, 1-5 = A-E, 6 = anything else (e.g. a manual "AB" edit or a
+# voided "X"). The exact text of every code 6 cell is kept in the other_responses table,
+# so those cells are compared by text, just as the CSV would be.
+RESPONSE_LETTERS = ["", "A", "B", "C", "D", "E", "?"]
+RESPONSE_CODES = {letter: code for code, letter in enumerate(RESPONSE_LETTERS[:6])}
+OTHER_RESPONSE = 6
+
+COLUMNS = ["filenames", "responses", "other_responses", "student_ids", "answer_confidences",
+           "student_id_confidences", "student_id_scores", "source_pdfs", "source_pages"]
+
+def encode_responses(answers):
+    return [RESPONSE_CODES.get(a, OTHER_RESPONSE) for a in answers]
+
+def other_response_table(records):
+    """(row, question, text) for every response that is not blank or A-E."""
+    others = [(i, q, a) for i, r in enumerate(records) for q, a in enumerate(r["answers"])
+              if a not in RESPONSE_CODES]
+    width = max((len(text) for _, _, text in others), default=1)
+    return np.array(others, dtype=[("row", np.int32), ("question", np.int32), ("text", f"U{width}")])
+
+def decode_responses(codes):
+    return np.array(RESPONSE_LETTERS)[codes]
+
+def load_page_sources(folder):
+    sources_path = os.path.join(folder, "page_sources.csv")
+    if not os.path.exists(sources_path):
+        return {}
+    with open(sources_path, newline="") as f:
+        return {row["filename"]: (row["source_pdf"], int(row["page"])) for row in csv.DictReader(f)}
+
+def _save_column(store_dir, name, array):
+    tmp_path = os.path.join(store_dir, f"{name}.tmp.npy")
+    np.save(tmp_path, array)
+    os.replace(tmp_path, os.path.join(store_dir, f"{name}.npy"))
+
+def write_store(folder, records):
+    """Write detection records (dicts with filename, answers, student_id, confidences and ID scores) as a columnar store."""
+    store_dir = os.path.join(folder, STORE_DIR)
+    os.makedirs(store_dir, exist_ok=True)
+    num_questions = max((len(r["answers"]) for r in records), default=0)
+    sources = load_page_sources(folder)
+
+    responses = np.zeros((len(records), num_questions), dtype=np.uint8)
+    answer_conf = np.full((len(records), num_questions), np.nan, dtype=np.float32)
+    id_conf = np.full((len(records), 9), np.nan, dtype=np.float32)
+    id_scores = np.full((len(records), 9, 10), np.nan, dtype=np.float32)
+    for i, r in enumerate(records):
+        responses[i, :len(r["answers"])] = encode_responses(r["answers"])
+        if r.get("answer_confidences") is not None:
+            conf = np.asarray(r["answer_confidences"])[:num_questions]
+            answer_conf[i, :len(conf)] = conf
+        if r.get("student_id_confidences") is not None:
+            conf = np.asarray(r["student_id_confidences"])[:9]
+            id_conf[i, :len(conf)] = conf
+        if r.get("student_id_scores") is not None:
+            id_scores[i] = np.asarray(r["student_id_scores"], dtype=np.float32)
+
+    filenames = [r["filename"] for r in records]
+    columns = {
+        "filenames": np.array(filenames, dtype=str),
+        "responses": responses,
+        "other_responses": other_response_table(records),
+        "student_ids": np.array([r["student_id"] for r in records], dtype=str),
+        "answer_confidences": answer_conf,
+        "student_id_confidences": id_conf,
+        "student_id_scores": id_scores,
+        "source_pdfs": np.array([sources.get(f, ("", 0))[0] for f in filenames], dtype=str),
+        "source_pages": np.array([sources.get(f, ("", 0))[1] for f in filenames], dtype=np.int32),
+    }
+    for name, array in columns.items():
+        _save_column(store_dir, name, array)
+
+    # Remember which version of the CSV this store matches, so manual CSV edits are picked up.
+    csv_path = os.path.join(folder, CSV_NAME)
+    csv_stat = os.stat(csv_path) if os.path.exists(csv_path) else None
+    with open(os.path.join(store_dir, "meta.json"), "w") as f:
+        json.dump({
+            "rows": len(records),
+            "questions": num_questions,
+            "csv_mtime_ns": csv_stat.st_mtime_ns if csv_stat else None,
+            "csv_size": csv_stat.st_size if csv_stat else None,
+        }, f)
+
+def _read_columns(store_dir, mmap=True):
+    """Load every column present; stores written by older versions may lack some."""
+    mode = "r" if mmap else None
+    paths = {name: os.path.join(store_dir, f"{name}.npy") for name in COLUMNS}
+    return {name: np.load(path, mmap_mode=mode) for name, path in paths.items() if os.path.exists(path)}
+
+def store_is_current(folder):
+    meta_path = os.path.join(folder, STORE_DIR, "meta.json")
+    csv_path = os.path.join(folder, CSV_NAME)
+    if not os.path.exists(meta_path):
+        return False
+    if not all(os.path.exists(os.path.join(folder, STORE_DIR, f"{name}.npy")) for name in COLUMNS):
+        return False
+    if not os.path.exists(csv_path):
+        return True
+    with open(meta_path) as f:
+        meta = json.load(f)
+    csv_stat = os.stat(csv_path)
+    return meta["csv_mtime_ns"] == csv_stat.st_mtime_ns and meta["csv_size"] == csv_stat.st_size
+
+def rebuild_store_from_csv(folder, new_records=()):
+    """Re-encode all_detected_answers.csv, keeping confidences and ID scores already stored for each file.
+
+    new_records supplies confidences for rows that were just appended to the CSV.
+    """
+    store_dir = os.path.join(folder, STORE_DIR)
+    previous = {}
+    if os.path.exists(os.path.join(store_dir, "meta.json")):
+        old = _read_columns(store_dir, mmap=False)
+        old_scores = old.get("student_id_scores")
+        for i, f in enumerate(old["filenames"]):
+            previous[str(f)] = (old["answer_confidences"][i], old["student_id_confidences"][i],
+                                old_scores[i] if old_scores is not None else None)
+    for r in new_records:
+        previous[r["filename"]] = (r.get("answer_confidences"), r.get("student_id_confidences"),
+                                   r.get("student_id_scores"))
+
+    records = []
+    with open(os.path.join(folder, CSV_NAME), newline="", encoding="utf-8") as f:
+        reader = csv.reader(f)
+        next(reader)
+        for row in reader:
+            if not row:
+                continue
+            answer_conf, id_conf, id_scores = previous.get(row[0], (None, None, None))
+            records.append({
+                "filename": row[0],
+                "answers": row[1:-1],
+                "student_id": row[-1],
+                "answer_confidences": answer_conf,
+                "student_id_confidences": id_conf,
+                "student_id_scores": id_scores,
+            })
+    write_store(folder, records)
+
+def load_store(folder, mmap=True):
+    """Return the store columns for a folder, rebuilding them first if the CSV has changed."""
+    if not store_is_current(folder):
+        if not os.path.exists(os.path.join(folder, CSV_NAME)):
+            raise FileNotFoundError(f"No {CSV_NAME} or results store found in {folder}.")
+        print("🔄 all_detected_answers.csv has changed, rebuilding the results store...")
+        rebuild_store_from_csv(folder)
+    return _read_columns(os.path.join(folder, STORE_DIR), mmap)
+
+def split_answer_key(filenames):
+    """Return (index of the answer key row or None, indices of the student rows).
+
+    Rows whose filename contains "answers" are answer keys and are never scored. When there
+    are several, the last one is used everywhere, so every report agrees with scored_answers.csv.
+    """
+    is_key = np.char.find(np.char.lower(np.asarray(filenames, dtype=str)), "answers") >= 0
+    key_rows = np.flatnonzero(is_key)
+    if len(key_rows) > 1:
+        print(f"⚠️ {len(key_rows)} answer key rows found, using the last one ({filenames[key_rows[-1]]}).")
+    return (int(key_rows[-1]) if len(key_rows) else None), np.flatnonzero(~is_key)
+
+def other_responses(store):
+    """{(row, question): text} for every response that is not blank or A-E."""
+    return {(int(row), int(q)): str(text) for row, q, text in store["other_responses"]}
+
+def matches_key(store, student_rows, key_row, num_questions):
+    """Boolean (students x questions) matrix of responses equal to the answer key.
+
+    Codes are compared directly, except where both are code 6, which only match if
+    their text is the same (a voided key cell "X" does not match a student's "AB").
+    """
+    responses = np.asarray(store["responses"][:, :num_questions])
+    matches = responses[student_rows] == responses[key_row]
+    both_other = np.argwhere(matches & (responses[key_row] == OTHER_RESPONSE))
+    if len(both_other):
+        others = other_responses(store)
+        for i, q in both_other:
+            matches[i, q] = others.get((int(student_rows[i]), int(q))) == others.get((key_row, int(q)))
+    return matches
+
+def store_to_dataframe(store, num_questions=None):
+    """Build the all_detected_answers.csv layout as a DataFrame with categorical answer columns."""
+    import pandas as pd
+
+    responses = store["responses"]
+    num_questions = num_questions or responses.shape[1]
+    data = {"filename": pd.Series(store["filenames"], dtype=str)}
+    others = other_responses(store)
+    for q in range(min(num_questions, responses.shape[1])):
+        column = pd.Categorical.from_codes(responses[:, q], RESPONSE_LETTERS)
+        texts = {row: text for (row, question), text in others.items() if question == q}
+        if texts:
+            values = column.astype(object)
+            values[list(texts)] = list(texts.values())
+            column = pd.Categorical(values)
+        data[str(q + 1)] = column
+    data["student_id"] = pd.Series(store["student_ids"], dtype=str)
+    return pd.DataFrame(data)
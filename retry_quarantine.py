@@ -0,0 +1,20 @@
+import os
+from detect_answers import load_calibration, read_quarantine, retry_quarantine, write_results, index_recovered_pages
+
+def main():
+    folder = input("📂 Enter folder with PNG files or a page store: ").strip()
+    pending = [r["filename"] for r in read_quarantine(folder) if r["status"] == "quarantined"]
+    if not pending:
+        print("✅ No quarantined sheets to retry.")
+        return
+
+    print(f"🔁 Retrying {len(pending)} quarantined sheets...")
+    calibration = load_calibration(folder)
+    recovered = retry_quarantine(folder, calibration, pending)
+    if recovered:
+        write_results(folder, recovered, append=True)
+        index_recovered_pages(folder, recovered)
+    print(f"\n✅ Results updated. See {os.path.join(folder, 'quarantine.csv')} for any sheets still needing manual entry.")
+
+if __name__ == "__main__":
+    main()
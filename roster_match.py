@@ -0,0 +1,48 @@
+import numpy as np
+
+# --- Settings ---
+id_score_scale = 20.0      # brightness difference (0-255) that makes one bubble e times more likely to be the filled one
+auto_accept_margin = 5.0   # best roster ID must be e^5 (~150) times more likely than the runner-up to be accepted
+max_fit_deficit = 4.0      # ...and no more than e^4 (~55) times less likely than the sheet's own reading,
+                           # which rules out students who are not on the roster
+
+# Reading each ID column on its own means one smudged digit makes the whole ID unknown.
+# Here every column's 10 bubble brightnesses become a probability for each digit, and
+# the likelihood of each student ID on the roster is the product over its 9 digits. A
+# smudged digit then only has to be disambiguated among IDs that actually exist.
+def digit_log_probs(scores):
+    """Log probability of each digit (9x10) from the mean bubble brightnesses; darker is more likely."""
+    scores = np.nan_to_num(np.asarray(scores, dtype=np.float64), nan=255.0, posinf=255.0)
+    logits = -scores / id_score_scale
+    logits -= logits.max(axis=1, keepdims=True)
+    return logits - np.log(np.exp(logits).sum(axis=1, keepdims=True))
+
+def roster_digits(roster_ids):
+    """Keep the 9-digit roster IDs and return them with their digits as an (n, 9) array."""
+    roster_ids = [r for r in roster_ids if len(r) == 9 and r.isdigit()]
+    digits = np.array([[int(c) for c in r] for r in roster_ids], dtype=np.intp).reshape(-1, 9)
+    return roster_ids, digits
+
+def match_roster(scores, roster_ids, digits=None):
+    """Return (best roster ID, margin, deficit) for one sheet's 9x10 ID scores.
+
+    margin is the log-likelihood gap between the best and second best roster ID, and
+    deficit the gap between the sheet's own digit-by-digit reading and the best roster
+    ID. All three are None when the sheet has no usable scores or the roster is empty.
+    """
+    if digits is None:
+        roster_ids, digits = roster_digits(roster_ids)
+    scores = np.asarray(scores, dtype=np.float64)
+    if not len(roster_ids) or not np.isfinite(scores).any():
+        return None, None, None
+
+    log_probs = digit_log_probs(scores)
+    likelihoods = log_probs[np.arange(9), digits].sum(axis=1)
+    order = np.argsort(likelihoods)[::-1]
+    best = likelihoods[order[0]]
+    margin = best - likelihoods[order[1]] if len(order) > 1 else float("inf")
+    deficit = log_probs.max(axis=1).sum() - best
+    return roster_ids[order[0]], round(float(margin), 2), round(float(deficit), 2)
+
+def is_confident(margin, deficit):
+    return margin is not None and margin >= auto_accept_margin and deficit <= max_fit_deficit
@@ -1,15 +1,9 @@
 import pandas as pd
 import os
 import datetime
-from reportlab.platypus import (
-    BaseDocTemplate, Frame, PageTemplate, Table, TableStyle,
-    Paragraph, Spacer, PageBreak, Image as RLImage
-)
-from reportlab.lib.pagesizes import A4
-from reportlab.lib import colors
+from reportlab.platypus import Table, TableStyle, Paragraph
 from reportlab.lib.styles import getSampleStyleSheet
-from reportlab.lib.units import inch
-from reportlab.lib.utils import ImageReader
+from report_common import TABLE_STYLE, university_logo, title_page, build_report
 
 
 def generate_pdf(output_path, data_df, heading, subheading, author, course_name, assessment_name,
@@ -17,74 +11,16 @@ def generate_pdf(output_path, data_df, heading, subheading, author, course_name,
 
     pdf_path = os.path.splitext(output_path)[0] + "_report.pdf"
     styles = getSampleStyleSheet()
-    elements = []
-
-    # Title Page
-    elements.append(RLImage(uni_logo_path, width=2 * inch, height=2 * inch, kind='proportional'))
-    elements.append(Spacer(1, 24))
-    elements.append(RLImage(staple_logo_path, width=1.7 * inch, height=1.7 * inch, kind='proportional'))
-    elements.append(Spacer(1, 24))
-    elements.append(Paragraph(heading, styles['Title']))
-    elements.append(Spacer(1, 6))
-    elements.append(Paragraph(subheading, styles['Normal']))
-    elements.append(Spacer(1, 6))
-    elements.append(Paragraph(f"Assessment: {assessment_name}", styles['Normal']))
-    elements.append(Spacer(1, 6))
-    elements.append(Paragraph(author, styles['Normal']))
-    elements.append(Spacer(1, 24))
-    elements.append(Paragraph(
-        "Report generated by the S.T.A.P.L.E. system, designed by School of Biosciences' TEL Team, University of Liverpool.",
-        styles['Italic']
-    ))
-    elements.append(PageBreak())
+    elements = title_page(heading, subheading, author, assessment_name, staple_logo_path, uni_logo_path)
 
     # Score Table
     elements.append(Paragraph("Student Scores", styles['Heading2']))
     table_data = [data_df.columns.tolist()] + data_df.astype(str).values.tolist()
     table = Table(table_data, repeatRows=1)
-    table.setStyle(TableStyle([
-        ('BACKGROUND', (0, 0), (-1, 0), colors.HexColor("#003366")),
-        ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
-        ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
-        ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
-        ('FONTNAME', (0, 1), (-1, -1), 'Helvetica'),
-        ('FONTSIZE', (0, 0), (-1, 0), 10),
-        ('FONTSIZE', (0, 1), (-1, -1), 9),
-        ('BOTTOMPADDING', (0, 0), (-1, 0), 6),
-        ('TOPPADDING', (0, 1), (-1, -1), 4),
-        ('GRID', (0, 0), (-1, -1), 0.25, colors.grey),
-    ]))
+    table.setStyle(TableStyle(TABLE_STYLE))
     elements.append(table)
 
-    # Footer
-    def add_footer(canvas, doc):
-        footer_text = "For more information about the S.T.A.P.L.E. system please contact Dr. Robert Treharne (R.Treharne@liverpool.ac.uk)."
-        canvas.saveState()
-        canvas.setFont('Helvetica-Oblique', 7)
-        canvas.setFillColor(colors.grey)
-        canvas.drawCentredString(A4[0] / 2, 20, footer_text)
-
-        staple_img = ImageReader(staple_logo_path)
-        orig_width, orig_height = staple_img.getSize()
-        display_width = 45
-        aspect = orig_height / orig_width
-        display_height = display_width * aspect
-        canvas.drawImage(staple_logo_path,
-                         A4[0] - display_width - 10,
-                         5,
-                         width=display_width,
-                         height=display_height,
-                         mask='auto')
-        canvas.drawRightString(A4[0] - display_width - 14, 20, f"Page {doc.page}")
-        canvas.restoreState()
-
-    doc = BaseDocTemplate(pdf_path, pagesize=A4)
-    frame = Frame(doc.leftMargin, doc.bottomMargin + 30, doc.width, doc.height - 40, id='normal')
-    template = PageTemplate(id='with-footer', frames=frame, onPage=add_footer)
-    doc.addPageTemplates([template])
-    doc.build(elements)
-
-    print(f"\n📄 PDF report saved to: {pdf_path}")
+    build_report(pdf_path, elements, staple_logo_path)
 
 def main():
     file_path = input("Enter the path to scored_answers.csv: ").strip()
@@ -101,10 +37,8 @@ def main():
     report_subheading = f"Course: {course_name}"
     report_author = f"Report generated by {author_name} on {report_date}"
 
-    uni_logo_png = "logo_converted.png"
-
     generate_pdf(file_path, df, report_heading, report_subheading, report_author,
-                 course_name, assessment_name, "staple.png", uni_logo_png)
+                 course_name, assessment_name, "staple.png", university_logo())
 
 if __name__ == "__main__":
     main()
@@ -1,13 +1,13 @@
 import os
-import cv2
 import numpy as np
 import matplotlib.pyplot as plt
-from glob import glob
 from tqdm import tqdm
 from datetime import datetime
+from page_store import list_pages, load_page_index, page_shape
 
 def validate_image_areas(folder_path, z_thresh=2.0):
-    image_paths = sorted(glob(os.path.join(folder_path, '*.png')))
+    image_paths = list_pages(folder_path)
+    index = load_page_index(folder_path)
     areas = []
     widths = []
     heights = []
@@ -15,11 +15,12 @@ def validate_image_areas(folder_path, z_thresh=2.0):
     print(f"\nProcessing {len(image_paths)} image(s)...\n")
 
     for path in tqdm(image_paths, desc="Loading images"):
-        img = cv2.imread(path)
-        if img is None:
+        # Stored pages are sized from the index; PNGs still have to be decoded.
+        try:
+            h, w = page_shape(folder_path, path, index)
+        except ValueError:
             print(f"Warning: Unable to read image {path}")
             continue
-        h, w = img.shape[:2]
         area = w * h
         areas.append(area)
         widths.append(w)
@@ -74,7 +75,7 @@ def validate_image_areas(folder_path, z_thresh=2.0):
     plt.show()
 
 if __name__ == '__main__':
-    folder = input("Enter the path to the folder containing .png images: ").strip()
+    folder = input("Enter the path to the folder containing .png images or a page store: ").strip()
     if not os.path.isdir(folder):
         print("Invalid directory. Please try again.")
     else:
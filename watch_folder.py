@@ -0,0 +1,131 @@
+import os
+import csv
+import re
+import time
+import fitz  # PyMuPDF
+from process_pdf import render_pdf_pages, render_pdf_to_store, record_page_sources
+from detect_answers import load_calibration, detect_with_retry, write_results, make_buffers
+from page_hash import load_hash_index
+from page_store import list_pages, has_page, check_page_format
+
+# --- Settings ---
+poll_interval = 5  # seconds between scans of the drop folder
+settle_time = 10   # seconds a PDF must stay unchanged before it is rendered
+use_page_store = False  # True: render new pages into the memory-mapped page store instead of PNGs
+
+def load_rendered_pdfs(image_dir):
+    """{source PDF: its page filenames} for every PDF already rendered into the image folder."""
+    sources_path = os.path.join(image_dir, "page_sources.csv")
+    if not os.path.exists(sources_path):
+        return {}
+    rendered = {}
+    with open(sources_path, newline="") as f:
+        for row in csv.DictReader(f):
+            rendered.setdefault(row["source_pdf"], []).append(row["filename"])
+    return rendered
+
+def load_processed_pdfs(image_dir):
+    """Source PDFs whose results have been written. Folders from older versions count every rendered PDF."""
+    processed_path = os.path.join(image_dir, "processed_pdfs.csv")
+    if not os.path.exists(processed_path):
+        return set(load_rendered_pdfs(image_dir))
+    with open(processed_path, newline="") as f:
+        return {row["source_pdf"] for row in csv.DictReader(f)}
+
+def record_processed_pdf(image_dir, pdf_path, processed):
+    processed_path = os.path.join(image_dir, "processed_pdfs.csv")
+    processed.add(pdf_path)
+    with open(processed_path, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(["source_pdf"])
+        writer.writerows([p] for p in sorted(processed))
+
+def next_page_number(image_dir):
+    numbers = [int(m.group(1)) for f in list_pages(image_dir)
+               for m in [re.match(r"page_(\d+)\.png$", f)] if m]
+    return max(numbers, default=0) + 1
+
+def is_complete_pdf(pdf_path):
+    try:
+        with fitz.open(pdf_path) as doc:
+            return len(doc) > 0
+    except Exception:
+        return False
+
+def find_ready_pdfs(drop_dir, processed, pending):
+    """Return PDFs whose size and mtime have not changed for settle_time seconds."""
+    now = time.time()
+    ready = []
+    for f in sorted(os.listdir(drop_dir)):
+        path = os.path.abspath(os.path.join(drop_dir, f))
+        if not f.lower().endswith(".pdf") or f == "single.pdf" or path in processed:
+            continue
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:  # moved or deleted since listdir
+            pending.pop(path, None)
+            continue
+        signature = (stat.st_size, stat.st_mtime)
+        if pending.get(path, (None, now))[0] != signature:
+            pending[path] = (signature, now)
+        elif now - pending[path][1] >= settle_time and is_complete_pdf(path):
+            ready.append(path)
+            del pending[path]
+    return ready
+
+def render_new_pdf(pdf_path, image_dir, rendered):
+    """Render a PDF's pages, reusing the pages of an earlier attempt that failed after rendering."""
+    if pdf_path in rendered and all(has_page(image_dir, f) for f in rendered[pdf_path]):
+        return rendered[pdf_path]
+    render = render_pdf_to_store if use_page_store else render_pdf_pages
+    sources = render(pdf_path, image_dir, next_page_number(image_dir))
+    record_page_sources(image_dir, sources, append=True)
+    rendered[pdf_path] = [filename for filename, _, _ in sources]
+    return rendered[pdf_path]
+
+def watch(drop_dir, image_dir):
+    os.makedirs(image_dir, exist_ok=True)
+    check_page_format(image_dir, use_page_store)
+
+    rendered = load_rendered_pdfs(image_dir)
+    processed_pdfs = load_processed_pdfs(image_dir)
+    pending = {}
+    calibration = None
+    buffers = make_buffers()
+    hash_index = load_hash_index(image_dir)
+    processed = failed = 0
+
+    print(f"👀 Watching {drop_dir} for new PDFs (Ctrl+C to stop)...")
+    try:
+        while True:
+            for pdf_path in find_ready_pdfs(drop_dir, processed_pdfs, pending):
+                print(f"\n📄 New scan: {os.path.basename(pdf_path)}")
+                # A PDF only counts as processed once its results are written. If anything fails
+                # (a locked CSV, a bad render, calibration), it is retried once it has settled again.
+                try:
+                    filenames = render_new_pdf(pdf_path, image_dir, rendered)
+                    if calibration is None:
+                        calibration = load_calibration(image_dir)
+                    records = detect_with_retry(image_dir, filenames, calibration, buffers, hash_index)
+                    write_results(image_dir, records, append=True)
+                    record_processed_pdf(image_dir, pdf_path, processed_pdfs)
+                except Exception as e:
+                    print(f"❌ {os.path.basename(pdf_path)} could not be processed ({e}). It will be retried.")
+                    continue
+                processed += len(records)
+                failed += len(filenames) - len(records)
+                print(f"✅ {processed} sheets detected so far ({failed} not detected, see quarantine.csv and duplicate_scans.csv).")
+
+            time.sleep(poll_interval)
+    except KeyboardInterrupt:
+        print(f"\n🛑 Stopped watching. {processed} sheets detected, {failed} not detected.")
+
+def main():
+    drop_dir = input("📂 Enter the drop folder the scanner saves PDFs to: ").strip()
+    if not os.path.isdir(drop_dir):
+        raise NotADirectoryError("Invalid drop folder.")
+    image_dir = input("Enter the output folder for PNG images: ").strip()
+    watch(drop_dir, image_dir)
+
+if __name__ == "__main__":
+    main()